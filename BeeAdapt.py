@@ -0,0 +1,231 @@
+###############################################################################
+## Stigmee: A 3D browser and decentralized social network.
+## Copyright 2021 Duron Alain <duron.alain@gmail.com>
+##
+## This file is part of Stigmee.
+##
+## Project : Stigmee BeeBot
+## Version : 0.0-1
+## Date : 20-11-2021
+## Author : Alain Duron
+## File : BeeAdapt.py
+##
+## Stigmee is free software: you can redistribute it and/or modify it
+## under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+
+# TODO:
+#   Adapt the selection pressure (tournament size) as well
+
+import sys
+import math
+import random
+
+"""
+AdaptiveController tunes a BeeVolve run online from the outcome of each child bred :
+
+- the mutation operator (SCR / INV) is picked for every child by a discounted UCB bandit, rewarded
+  when the mutation improves the child;
+- the mutation rate and section size (apct) follow the 1/5th success rule : they grow when more than
+  a fifth of the mutations of a generation improve their child and shrink otherwise, and the rate
+  is raised while the best fitness stagnates;
+- the crossover section (xpct) widens towards a uniform crossover while at most half of the
+  crossover children beat both their parents (on the test workloads, narrower sections only make
+  the population converge early, see benchmark()).
+"""
+
+
+class Bandit:
+    """
+    Discounted UCB1 : old rewards fade so that the choice follows the run as it converges
+    """
+
+    def __init__(self, _arms, _discount=0.9, _exploration=0.5):
+
+        self.arms = list(_arms)
+        self.discount = _discount
+        self.exploration = _exploration
+        self.counts = [0.0] * len(self.arms)
+        self.rewards = [0.0] * len(self.arms)
+        self.chosen = [0] * len(self.arms)  # times each arm was picked, for statistics
+
+    def choose(self):
+        """
+        returns the index of the arm to play
+        """
+        total = sum(self.counts)
+        best, bestValue = 0, -1.0
+        for arm, count in enumerate(self.counts):
+            if count < 1e-9:
+                value = math.inf
+            else:
+                value = self.rewards[arm] / count + self.exploration * math.sqrt(math.log(max(total, 1.0)) / count)
+            if value > bestValue:
+                best, bestValue = arm, value
+        self.chosen[best] += 1
+        return best
+
+    def reward(self, arm, value):
+
+        self.counts[arm] += 1
+        self.rewards[arm] += value
+
+    def decay(self):
+
+        self.counts = [count * self.discount for count in self.counts]
+        self.rewards = [reward * self.discount for reward in self.rewards]
+
+
+class AdaptiveController:
+
+    def __init__(self, _volve, _mutations=("SCR", "INV"), _patience=5, _minRate=0.01, _maxRate=0.5,
+                 _discount=0.9):
+        """
+        :param _volve: the BeeVolve instance to tune
+        :param _mutations: mutation operators to pick from
+        :param _patience: generations without improvement of the best fitness before raising the mutation rate
+        :param _minRate: lower bound of the mutation rate
+        :param _maxRate: upper bound of the mutation rate
+        :param _discount: per generation discount of the bandit rewards
+        """
+        self.volve = _volve
+        self.mutations = Bandit(_mutations, _discount)
+        self.patience = _patience
+        self.minRate = min(_minRate, _volve.mutationRate)
+        self.maxRate = max(_maxRate, _volve.mutationRate)
+        # A section shorter than 2 genes can't be shuffled
+        self.minApct = 200.0 / _volve.strandSize
+        self.apct = float(_volve.apct) if _volve.apct is not None else 20.0
+        self.xpct = float(_volve.xpct) if _volve.xpct is not None else 100.0
+
+        self.lastBest = None
+        self.stagnation = 0
+        self.mutnArm = 0
+        # Outcomes of the current generation
+        self.xovrTrials = self.xovrSuccesses = 0
+        self.mutnTrials = self.mutnSuccesses = 0
+        self.history = []   # per generation : [mutationRate, apct, xpct, crossover success, mutation success]
+
+    def chooseCrossover(self):
+        """
+        Set the crossover section size of the next child (None : uniform over the whole strand)
+        """
+        self.volve.xpct = None if self.xpct >= 100.0 else int(self.xpct)
+
+    def chooseMutation(self):
+        """
+        returns the mutation operator of the next child, with its section size set
+        """
+        self.mutnArm = self.mutations.choose()
+        self.volve.apct = int(self.apct + 0.5)
+        return self.mutations.arms[self.mutnArm]
+
+    def recordCrossover(self, parent1, parent2, fitness):
+        """
+        :param fitness: fitness of the child out of the crossover (before its mutation)
+        """
+        self.xovrTrials += 1
+        self.xovrSuccesses += fitness < min(parent1.getStrandFitness(), parent2.getStrandFitness())
+
+    def recordMutation(self, before, child):
+        """
+        :param before: fitness of the child before its mutation
+        """
+        success = child.getStrandFitness() < before
+        self.mutations.reward(self.mutnArm, 1.0 if success else 0.0)
+        self.mutnTrials += 1
+        self.mutnSuccesses += success
+
+    def endGeneration(self):
+        """
+        Tune the rates and section sizes from the outcome of the generation
+        """
+        volve = self.volve
+        best = volve.best.getStrandFitness()
+        if self.lastBest is not None and best >= self.lastBest:
+            self.stagnation += 1
+        else:
+            self.stagnation = 0
+        self.lastBest = best
+
+        if self.stagnation >= self.patience:
+            volve.mutationRate = min(self.maxRate, volve.mutationRate * 1.5)
+        elif self.mutnTrials:
+            factor = 1.2 if self.mutnSuccesses > self.mutnTrials / 5 else 1 / 1.2
+            volve.mutationRate = min(self.maxRate, max(self.minRate, volve.mutationRate * factor))
+            self.apct = min(100.0, max(self.minApct, self.apct * factor))
+
+        if self.xovrTrials and self.xovrSuccesses <= self.xovrTrials / 2:
+            self.xpct = min(100.0, self.xpct * 1.2)
+
+        self.history.append([volve.mutationRate, self.apct, self.xpct,
+                             self.xovrSuccesses / max(1, self.xovrTrials),
+                             self.mutnSuccesses / max(1, self.mutnTrials)])
+        self.mutations.decay()
+        self.xovrTrials = self.xovrSuccesses = 0
+        self.mutnTrials = self.mutnSuccesses = 0
+
+    def stats(self):
+
+        return {"mutation_rate": self.volve.mutationRate, "apct": self.apct, "xpct": self.xpct,
+                "mutation_picks": dict(zip(self.mutations.arms, self.mutations.chosen))}
+
+
+def generationsTo(_target, _runs, _maxIter, **kwargs):
+    """
+    returns the generations each of _runs seeded runs took to reach _target (_maxIter when it wasn't)
+    """
+    from BeeVolve import BeeVolve
+
+    generations = []
+    for run in range(_runs):
+        random.seed(run)
+        volve = BeeVolve(_maxIter=_maxIter, **kwargs)
+        while volve.best.getStrandFitness() > _target and volve.step():
+            pass
+        generations.append(volve.iteration)
+    return generations
+
+
+def benchmark(_inputFile="test_urls.txt", _sizes=(21, 50), _psize=100, _runs=3, _maxIter=300, _slack=0.02,
+              _settings=((0.05, None), (0.5, None), (0.05, 50))):
+    """
+    Generations to reach the optimum of the test fitness (within _slack, exactly for the urls of _inputFile)
+    with fixed and adaptive parameters, from several (mutation rate, xpct) settings, on the urls of
+    _inputFile and on larger synthetic url collections
+    """
+    for size in _sizes:
+        if size <= 21:
+            source = {"_inputFile": _inputFile}
+            slack = 0
+        else:
+            source = {"_inputFile": None, "_data": {i: "https://example.com/{}".format(i) for i in range(size)}}
+            slack = _slack
+        # Sorted genes 0..size-1, the last gene being ignored by the weighted inversion fitness
+        target = (size - 1) * (size - 2) // 2 * (1 + slack)
+        for mutRate, xpct in _settings:
+            for adaptive in (False, True):
+                generations = generationsTo(target, _runs, _maxIter, _psize=_psize, _mutRate=mutRate, _initType="RGS",
+                                            _xovrType="SIM", _slctType="BIN", _mutnType="SCR", _strandSize=size,
+                                            _xpct=xpct, _adaptive=adaptive, **source)
+                print("[b] strand size {:>3} - target {:.0f} - rate {} - xpct {} - {} - generations : mean {:.1f} "
+                      "(min {}, max {})".format(size, target, mutRate, xpct, "adaptive" if adaptive else "fixed   ",
+                                                sum(generations) / _runs, min(generations), max(generations)))
+
+
+if __name__ == "__main__":
+    # python BeeAdapt.py [file] [strand sizes...]
+    inputFile = sys.argv[1] if len(sys.argv) > 1 else "test_urls.txt"
+    sizes = tuple(int(size) for size in sys.argv[2:]) or (21, 50)
+    benchmark(inputFile, sizes)
@@ -0,0 +1,301 @@
+###############################################################################
+## Stigmee: A 3D browser and decentralized social network.
+## Copyright 2021 Duron Alain <duron.alain@gmail.com>
+##
+## This file is part of Stigmee.
+##
+## Project : Stigmee BeeBot
+## Version : 0.0-1
+## Date : 20-11-2021
+## Author : Alain Duron
+## File : BeeAsyncDB.py
+##
+## Stigmee is free software: you can redistribute it and/or modify it
+## under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+# TODO:
+#   Switch to a native asyncio driver if MariaDB ships one, the surface can stay the same
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from BeeDB import *
+
+"""
+AsyncBeeDB is the asyncio flavour of BeeDB, meant for curation services handling many
+concurrent users. The MariaDB connector is blocking, so each connection is driven by a
+dedicated worker thread : calls never block the event loop, a connection is only ever used
+from its own thread, and calls issued without awaiting are queued to the server in order
+(pipelining). Whole batches of statements can also be sent in a single hop with pipeline().
+
+Queries return their rows (the blocking fetch happens on the worker thread) instead of a cursor.
+"""
+class AsyncBeeDB:
+
+    def __init__(self, _db, _worker=None):
+        """
+        :param _db: a connected BeeDB instance, used only from this object's worker thread
+        :param _worker: the single thread executor _db was created on, if any
+        """
+        self.db = _db
+        self.worker = _worker if _worker is not None else ThreadPoolExecutor(max_workers=1, thread_name_prefix="beedb")
+        self.tainted = False  # An operation was cancelled mid-flight, the transaction state is unknown
+
+    @classmethod
+    async def connect(cls, _user, _password, _host, _port, _database, _connector=None):
+        """
+        Open a connection without blocking the event loop
+        """
+        worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="beedb")
+        try:
+            db = await asyncio.get_running_loop().run_in_executor(
+                worker, lambda: BeeDB(_user, _password, _host, _port, _database,
+                                      _connector=_connector, _exitOnError=False))
+        except BaseException:
+            worker.shutdown(wait=False)
+            raise
+        return cls(db, worker)
+
+    async def run(self, fn, *args):
+        """
+        Run fn(*args) on the connection thread. If the awaiting task is cancelled, a queued call
+        is dropped, a running one is interrupted when the driver allows it and the connection is
+        marked as tainted so that its pool rolls it back (or discards it) on release.
+        """
+        future = self.worker.submit(fn, *args)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if not future.cancel():
+                self.tainted = True
+                interrupt = getattr(self.db.conn, "interrupt", None)
+                if interrupt is not None:
+                    interrupt()
+            raise
+
+    def fetch(self, _query, _paramtuple):
+
+        cur = self.db.execute_query(_query, _paramtuple)
+        return cur.fetchall()
+
+    async def execute_query(self, _query, _paramtuple=None):
+        """
+        returns all the rows of the query
+        """
+        return await self.run(self.fetch, _query, _paramtuple)
+
+    async def execute_stmt(self, _stmt, _paramtuple=None, _commit=False):
+
+        return await self.run(self.db.execute_stmt, _stmt, _paramtuple, _commit)
+
+    async def executemany(self, _stmt, _paramlist, _chunkSize=1000, _commit=False):
+
+        return await self.run(self.db.executemany, _stmt, _paramlist, _chunkSize, _commit)
+
+    def runPipeline(self, _statements, _commit):
+
+        results = []
+        for stmt in _statements:
+            sql, params = stmt if isinstance(stmt, tuple) else (stmt, None)
+            cur = self.db.execute_query(sql, params)
+            # Statements returning rows give their rows, the others their row count
+            results.append(cur.fetchall() if cur.description is not None else cur.rowcount)
+        if _commit:
+            self.db.commit()
+        return results
+
+    async def pipeline(self, _statements, _commit=False):
+        """
+        Send a sequence of statements (sql or (sql, params)) in a single hop to the connection
+        thread, one result per statement. Avoids one event loop round trip per statement.
+        """
+        return await self.run(self.runPipeline, list(_statements), _commit)
+
+    async def commit(self):
+
+        await self.run(self.db.commit)
+
+    async def rollback(self):
+
+        await self.run(self.db.rollback)
+
+    async def ping(self):
+
+        return await self.run(self.db.ping)
+
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        Commit on success, rollback on any exception (including cancellation)
+        """
+        try:
+            yield self
+        except BaseException:
+            await asyncio.shield(self.run(self.db.rollback))
+            raise
+        else:
+            await self.commit()
+
+    async def close(self):
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.worker, self.db.close)
+        finally:
+            self.worker.shutdown(wait=False)
+
+
+"""
+AsyncBeeDBPool is the asyncio counterpart of BeeDBPool : a bounded set of AsyncBeeDB
+connections with health checks and reconnect backoff. It also exposes the BeeDB surface
+itself, each call borrowing a connection for its own duration.
+
+There is no pool level commit() / rollback() : a pool call commits its own work (_commit),
+and work spanning several calls borrows a connection and commits on it :
+
+    async with pool.transaction() as adb:       # committed on exit, rolled back on error
+        await adb.execute_stmt(...)
+
+    async with pool.connection() as adb:
+        await adb.execute_stmt(...)
+        await adb.commit()                      # uncommitted work is rolled back on release
+"""
+class AsyncBeeDBPool:
+
+    def __init__(self, _user, _password, _host, _port, _database, _maxSize=8,
+                 _timeout=30.0, _retries=5, _backoff=0.1, _maxBackoff=5.0, _healthCheck=True,
+                 _connector=None):
+        """
+        :param _maxSize: maximum number of connections alive at the same time
+        :param _timeout: seconds to wait for a free connection before raising BeeDBError
+        :param _retries: connection attempts before giving up
+        :param _backoff: initial delay between two attempts, doubled after each failure
+        :param _maxBackoff: upper bound for the delay between two attempts
+        :param _healthCheck: ping idle connections before lending them
+        :param _connector: callable with the mariadb.connect signature, default mariadb.connect
+        """
+        self.user = _user
+        self.password = _password
+        self.host = _host
+        self.port = _port
+        self.database = _database
+        self.maxSize = _maxSize
+        self.timeout = _timeout
+        self.retries = _retries
+        self.backoff = _backoff
+        self.maxBackoff = _maxBackoff
+        self.healthCheck = _healthCheck
+        self.connector = _connector
+
+        self.idle = []              # Most recently used connection last
+        self.size = 0
+        self.slots = asyncio.Semaphore(self.maxSize)
+        self.closed = False
+
+    async def open(self):
+
+        delay = self.backoff
+        for attempt in range(self.retries):
+            try:
+                return await AsyncBeeDB.connect(self.user, self.password, self.host, self.port,
+                                                self.database, _connector=self.connector)
+            except BeeDBError:
+                if attempt == self.retries - 1:
+                    raise
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.maxBackoff)
+
+    async def acquire(self, _timeout=None):
+
+        if self.closed:
+            raise BeeDBError("pool is closed")
+        timeout = self.timeout if _timeout is None else _timeout
+        try:
+            await asyncio.wait_for(self.slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise BeeDBError("no connection available after {}s ({} in use)".format(timeout, self.size))
+
+        try:
+            while self.idle:
+                adb = self.idle.pop()
+                if not self.healthCheck or await adb.ping():
+                    return adb
+                self.size -= 1
+                await adb.close()
+            adb = await self.open()
+            self.size += 1
+            return adb
+        except BaseException:
+            self.slots.release()
+            raise
+
+    async def release(self, adb, _discard=False):
+
+        try:
+            if not _discard:
+                try:
+                    await asyncio.shield(adb.run(adb.db.rollback))
+                    adb.tainted = False
+                except DB_ERRORS:
+                    _discard = True
+            if _discard or self.closed:
+                self.size -= 1
+                await adb.close()
+            else:
+                self.idle.append(adb)
+        finally:
+            self.slots.release()
+
+    @asynccontextmanager
+    async def connection(self):
+
+        adb = await self.acquire()
+        broken = False
+        try:
+            yield adb
+        except DB_ERRORS:
+            broken = True
+            raise
+        finally:
+            await self.release(adb, _discard=broken)
+
+    @asynccontextmanager
+    async def transaction(self):
+
+        async with self.connection() as adb:
+            async with adb.transaction():
+                yield adb
+
+    async def execute_query(self, _query, _paramtuple=None):
+
+        async with self.connection() as adb:
+            return await adb.execute_query(_query, _paramtuple)
+
+    async def execute_stmt(self, _stmt, _paramtuple=None, _commit=True):
+        """
+        Unlike BeeDB, commits by default : the borrowed connection is rolled back on release
+        """
+        async with self.connection() as adb:
+            return await adb.execute_stmt(_stmt, _paramtuple, _commit)
+
+    async def pipeline(self, _statements, _commit=True):
+
+        async with self.connection() as adb:
+            return await adb.pipeline(_statements, _commit)
+
+    async def close(self):
+
+        self.closed = True
+        while self.idle:
+            self.size -= 1
+            await self.idle.pop().close()
@@ -28,11 +28,77 @@
 #   Handle other database systems if necessary
 
 # Imports
+import os
+import sys
+import time
+import weakref
+import tempfile
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
 try:
     import mariadb
-    import sys
 except ImportError:
-    print("[E] can't find the 'google' module. try : 'pip install mariadb'")
+    mariadb = None
+    print("[E] can't find the 'mariadb' module. try : 'pip install mariadb'")
+
+# Driver errors the pool knows how to recover from
+DB_ERRORS = (sqlite3.Error,) if mariadb is None else (sqlite3.Error, mariadb.Error)
+
+
+class BeeDBError(Exception):
+    """
+    Raised when a connection cannot be established or borrowed
+    """
+    pass
+
+
+def removeDatabase(path):
+    """
+    Remove a SQLite database file along with its WAL journal files
+    """
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+class SQLiteStandIn:
+    """
+    Test double standing in for the MariaDB connector. It accepts the same connection
+    arguments as mariadb.connect and hands out sqlite3 connections on a shared database,
+    so BeeDB and BeeDBPool can be exercised locally without a MariaDB server.
+    Both drivers use the qmark ('?') parameter style, so statements are portable as long
+    as they stick to common SQL.
+    """
+
+    def __init__(self, _path=None):
+        """
+        :param _path: database file, or None for a temporary file removed with the stand-in
+        """
+        if _path is None:
+            fd, _path = tempfile.mkstemp(prefix="beedb_", suffix=".db")
+            os.close(fd)
+            weakref.finalize(self, removeDatabase, _path)
+        self.path = _path
+        self.connections = 0
+        self.failures = 0       # Number of upcoming connect() calls that should fail (failure injection)
+        # WAL lets readers run alongside the writer, concurrent writers wait on the busy timeout
+        # (a shared-cache memory database would fail them with 'table is locked' instead)
+        keeper = sqlite3.connect(self.path)
+        keeper.execute("PRAGMA journal_mode=WAL")
+        keeper.close()
+
+    def __call__(self, user=None, password=None, host=None, port=None, database=None):
+        if self.failures > 0:
+            self.failures -= 1
+            raise sqlite3.OperationalError("stand-in connection refused")
+        self.connections += 1
+        return sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level="DEFERRED")
 
 
 """
@@ -41,7 +107,17 @@ for other Stigmee BeeBot modules
 """
 class BeeDB:
 
-    def __init__(self, _user, _password, _host, _port, _database):
+    # Upper bound of bound values in a single statement (SQLite historical default,
+    # well below MariaDB's 65535 placeholders limit)
+    MAX_PARAMS = 999
+
+    def __init__(self, _user, _password, _host, _port, _database, _connector=None, _exitOnError=True,
+                 _stmtCacheSize=32):
+        """
+        :param _connector: callable with the mariadb.connect signature (eg. SQLiteStandIn), default mariadb.connect
+        :param _exitOnError: exit the program when the connection fails (standalone use), otherwise raise BeeDBError
+        :param _stmtCacheSize: number of prepared statements kept per connection (0 disables the cache)
+        """
 
         # Connect to MariaDB Platform
         self.user = _user
@@ -49,57 +125,241 @@ class BeeDB:
         self.host = _host
         self.port = _port
         self.database = _database
+        self.connector = _connector
+        self.exitOnError = _exitOnError
         self.cur = None
         self.conn = None
 
+        # Prepared statement cache : sql text -> prepared cursor, least recently used first
+        self.stmtCacheSize = _stmtCacheSize
+        self.stmtCache = OrderedDict()
+        self.stmtHits = 0
+        self.stmtMisses = 0
+
         # Setup the connection
         self.connect()
         self.get_cursor()
 
     def connect(self):
 
+        connector = self.connector
+        if connector is None:
+            if mariadb is None:
+                self.fail("mariadb connector is not installed")
+            connector = mariadb.connect
+
         try:
-            self.conn = mariadb.connect(
+            self.conn = connector(
                 user=self.user,
                 password=self.password,
                 host=self.host,
                 port=self.port,
                 database=self.database
             )
-        except mariadb.Error as e:
-            print(f"Error connecting to MariaDB Platform: {e}")
-            sys.exit(1)
+        except DB_ERRORS as e:
+            self.fail(e)
 
         # By default auto commit is on
         # disable it and make it an argument in execute_stmt
-        self.conn.autocommit = False
+        if hasattr(self.conn, "autocommit"):
+            self.conn.autocommit = False
+
+    def fail(self, error):
+
+        if self.exitOnError:
+            print(f"Error connecting to MariaDB Platform: {error}")
+            sys.exit(1)
+        raise BeeDBError(f"Error connecting to MariaDB Platform: {error}")
+
+    def ping(self):
+        """
+        Health check : returns True if the connection still answers a trivial query
+        """
+        if self.conn is None:
+            return False
+        try:
+            cur = self.conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchall()
+            cur.close()
+            return True
+        except DB_ERRORS:
+            return False
+
+    def reconnect(self):
+        """
+        Drop the current connection (if any) and open a new one
+        """
+        try:
+            self.close()
+        except DB_ERRORS:
+            pass
+        self.stmtCache.clear()
+        self.conn = None
+        self.connect()
+        self.get_cursor()
 
     def get_cursor(self):
 
         # Get Cursor
         self.cur = self.conn.cursor()
 
+    def prepared_cursor(self, _sql):
+        """
+        returns the cursor holding the prepared statement of _sql, preparing it on first use.
+        MariaDB parses a prepared cursor's statement once and only binds parameters afterwards.
+        Other drivers (the SQLite stand-in) get a plain cursor per statement and rely on their
+        own statement cache.
+        """
+        if self.stmtCacheSize <= 0:
+            return self.cur
+
+        cur = self.stmtCache.get(_sql)
+        if cur is not None:
+            self.stmtHits += 1
+            self.stmtCache.move_to_end(_sql)
+            return cur
+
+        self.stmtMisses += 1
+        try:
+            cur = self.conn.cursor(prepared=True)
+        except TypeError:
+            cur = self.conn.cursor()
+        self.stmtCache[_sql] = cur
+        if len(self.stmtCache) > self.stmtCacheSize:
+            _, old = self.stmtCache.popitem(last=False)
+            try:
+                old.close()
+            except DB_ERRORS:
+                pass
+        return cur
+
+    def clear_stmt_cache(self):
+
+        for cur in self.stmtCache.values():
+            try:
+                cur.close()
+            except DB_ERRORS:
+                pass
+        self.stmtCache.clear()
+
     def execute_query(self, _query, _paramtuple=None):
         # example :
         # _query : "SELECT first_name,last_name FROM employees WHERE first_name=?",
         # _paramtuple : (some_name,)
+        #
+        # The returned cursor is the prepared cursor of _query : its rows stay available
+        # until the same query text is executed again
 
+        cur = self.prepared_cursor(_query)
         if _paramtuple is not None:
-            self.cur.execute(_query,_paramtuple)
+            cur.execute(_query,_paramtuple)
         else:
-            self.cur.execute(_query)
+            cur.execute(_query)
 
-        return self.cur
+        return cur
+
+    def stream_query(self, _query, _paramtuple=None, _chunkSize=1000):
+        """
+        Iterate over the rows of a large result set with bounded memory : rows are fetched
+        _chunkSize at a time from an unbuffered (server side) MariaDB cursor instead of being
+        transferred all at once. The connection must not run other queries until the iteration
+        is over or the iterator is closed.
+        """
+        try:
+            cur = self.conn.cursor(buffered=False)
+        except TypeError:
+            # sqlite3 cursors already step through results lazily
+            cur = self.conn.cursor()
+        try:
+            if _paramtuple is not None:
+                cur.execute(_query, _paramtuple)
+            else:
+                cur.execute(_query)
+            while True:
+                rows = cur.fetchmany(_chunkSize)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cur.close()
 
     def execute_stmt(self, _stmt, _paramtuple=None, _commit=False):
 
+        cur = self.prepared_cursor(_stmt)
         if _paramtuple is not None:
-            self.cur.execute(_stmt,_paramtuple)
+            cur.execute(_stmt,_paramtuple)
         else:
-            self.cur.execute(_stmt)
+            cur.execute(_stmt)
+
+        if _commit:
+            self.commit()
+
+    def executemany(self, _stmt, _paramlist, _chunkSize=1000, _commit=False):
+        """
+        Execute the same statement for every parameter tuple of _paramlist, sending them
+        to the server _chunkSize rows at a time instead of one round trip per row.
+        _paramlist can be any iterable (eg. a generator over a population)
+        returns the number of rows sent
+        """
+        count = 0
+        chunk = []
+        for params in _paramlist:
+            chunk.append(params)
+            if len(chunk) >= _chunkSize:
+                self.cur.executemany(_stmt, chunk)
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            self.cur.executemany(_stmt, chunk)
+            count += len(chunk)
+
+        if _commit:
+            self.commit()
+        return count
+
+    def insert_rows(self, _table, _columns, _rows, _chunkSize=500, _commit=False):
+        """
+        Insert rows using multi-row VALUES statements :
+            INSERT INTO _table (c1, c2) VALUES (?, ?), (?, ?), ...
+        The chunk size is capped so that a statement never binds more than MAX_PARAMS values
+        returns the number of rows inserted
+        """
+        columns = ", ".join(_columns)
+        placeholder = "(" + ", ".join("?" for _ in _columns) + ")"
+        chunkSize = max(1, min(_chunkSize, self.MAX_PARAMS // len(_columns)))
+        prefix = "INSERT INTO {} ({}) VALUES ".format(_table, columns)
+        stmts = {}  # statement text per chunk length, the last chunk is usually shorter
+
+        count = 0
+        chunk = []
+        for row in _rows:
+            chunk.extend(row)
+            count += 1
+            if count % chunkSize == 0:
+                self.cur.execute(self.values_stmt(stmts, prefix, placeholder, chunkSize), chunk)
+                chunk = []
+        if chunk:
+            self.cur.execute(self.values_stmt(stmts, prefix, placeholder, count % chunkSize), chunk)
 
         if _commit:
             self.commit()
+        return count
+
+    @staticmethod
+    def values_stmt(stmts, prefix, placeholder, nrows):
+
+        stmt = stmts.get(nrows)
+        if stmt is None:
+            stmt = prefix + ", ".join(placeholder for _ in range(nrows))
+            stmts[nrows] = stmt
+        return stmt
+
+    def batch(self, _stmt, _maxRows=1000, _maxDelay=1.0):
+        """
+        returns a BeeDBBatch group-committing _stmt on this connection
+        """
+        return BeeDBBatch(self, _stmt, _maxRows, _maxDelay)
 
     def commit(self):
 
@@ -109,6 +369,301 @@ class BeeDB:
 
         self.conn.rollback()
 
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager committing on success and rolling back on any exception :
+
+            with db.transaction():
+                db.execute_stmt("INSERT ...", (...))
+        """
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        else:
+            self.commit()
+
     def close(self):
 
-        self.conn.close()
\ No newline at end of file
+        if self.conn is not None:
+            self.clear_stmt_cache()
+            self.conn.close()
+
+
+"""
+BeeDBBatch buffers rows written with the same statement and writes them with executemany,
+committing as a group whenever _maxRows rows are pending or the oldest pending row is older
+than _maxDelay seconds. Used as a context manager, pending rows are flushed on exit.
+"""
+class BeeDBBatch:
+
+    def __init__(self, _db, _stmt, _maxRows=1000, _maxDelay=1.0):
+        """
+        :param _db: the BeeDB connection to write to
+        :param _stmt: the parameterized statement, eg. "INSERT INTO strands VALUES (?, ?, ?)"
+        :param _maxRows: group commit size threshold
+        :param _maxDelay: group commit time threshold in seconds (None to disable)
+        """
+        self.db = _db
+        self.stmt = _stmt
+        self.maxRows = _maxRows
+        self.maxDelay = _maxDelay
+        self.pending = []
+        self.since = None
+        self.written = 0
+        self.commits = 0
+
+    def add(self, params):
+
+        if not self.pending:
+            self.since = time.monotonic()
+        self.pending.append(params)
+        if len(self.pending) >= self.maxRows or \
+                (self.maxDelay is not None and time.monotonic() - self.since >= self.maxDelay):
+            self.flush()
+
+    def extend(self, paramlist):
+
+        for params in paramlist:
+            self.add(params)
+
+    def flush(self):
+
+        if not self.pending:
+            return
+        self.db.executemany(self.stmt, self.pending, _chunkSize=self.maxRows, _commit=True)
+        self.written += len(self.pending)
+        self.commits += 1
+        self.pending = []
+        self.since = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.pending = []
+            self.db.rollback()
+        return False
+
+
+"""
+BeeDBPool keeps a bounded set of BeeDB connections that can be shared between threads
+(parallel BeeVolve workers, a web front-end...). Each borrower gets a connection of its own
+with a fresh cursor and an empty prepared statement cache (cursors never outlive a borrow),
+connections are health checked before being handed out and reopened with an exponential
+backoff when the database is unreachable.
+"""
+class BeeDBPool:
+
+    def __init__(self, _user, _password, _host, _port, _database, _minSize=1, _maxSize=8,
+                 _timeout=30.0, _retries=5, _backoff=0.1, _maxBackoff=5.0, _healthCheck=True,
+                 _connector=None, _stmtCacheSize=32):
+        """
+        :param _minSize: number of connections opened upfront
+        :param _maxSize: maximum number of connections alive at the same time
+        :param _timeout: seconds to wait for a free connection before raising BeeDBError
+        :param _retries: connection attempts before giving up
+        :param _backoff: initial delay between two attempts, doubled after each failure
+        :param _maxBackoff: upper bound for the delay between two attempts
+        :param _healthCheck: ping idle connections before lending them
+        :param _connector: callable with the mariadb.connect signature, default mariadb.connect
+        :param _stmtCacheSize: prepared statements kept per pooled connection, for the duration of a borrow
+        """
+        self.user = _user
+        self.password = _password
+        self.host = _host
+        self.port = _port
+        self.database = _database
+        self.minSize = _minSize
+        self.maxSize = _maxSize
+        self.timeout = _timeout
+        self.retries = _retries
+        self.backoff = _backoff
+        self.maxBackoff = _maxBackoff
+        self.healthCheck = _healthCheck
+        self.connector = _connector
+        self.stmtCacheSize = _stmtCacheSize
+
+        self.idle = queue.LifoQueue()   # Most recently used connection first, keeps the others cold
+        self.size = 0                   # Connections alive, idle or borrowed
+        self.lock = threading.Lock()
+        self.closed = False
+
+        for _ in range(self.minSize):
+            with self.lock:
+                self.size += 1
+            self.idle.put(self.open())
+
+    def open(self):
+        """
+        Open a new BeeDB connection, retrying with exponential backoff
+        """
+        delay = self.backoff
+        for attempt in range(self.retries):
+            try:
+                return BeeDB(self.user, self.password, self.host, self.port, self.database,
+                             _connector=self.connector, _exitOnError=False,
+                             _stmtCacheSize=self.stmtCacheSize)
+            except BeeDBError as e:
+                if attempt == self.retries - 1:
+                    with self.lock:
+                        self.size -= 1
+                    raise e
+                time.sleep(delay)
+                delay = min(delay * 2, self.maxBackoff)
+
+    def acquire(self, _timeout=None):
+        """
+        Borrow a connection from the pool. The returned BeeDB has its own fresh cursor
+        and must be given back with release()
+        """
+        if self.closed:
+            raise BeeDBError("pool is closed")
+        timeout = self.timeout if _timeout is None else _timeout
+
+        try:
+            db = self.idle.get_nowait()
+        except queue.Empty:
+            db = None
+            with self.lock:
+                grow = self.size < self.maxSize
+                if grow:
+                    self.size += 1
+            if grow:
+                return self.lend(self.open())
+            try:
+                db = self.idle.get(timeout=timeout)
+            except queue.Empty:
+                raise BeeDBError("no connection available after {}s ({} in use)".format(timeout, self.size))
+
+        if self.healthCheck and not db.ping():
+            # Stale connection (server restart, idle timeout...) : replace it, keeping its slot
+            try:
+                db.close()
+            except DB_ERRORS:
+                pass
+            db = self.open()
+        return self.lend(db)
+
+    def lend(self, db):
+
+        db.get_cursor()
+        return db
+
+    def release(self, db, _discard=False):
+        """
+        Give a connection back to the pool. Pending work is rolled back and the cursors of
+        the borrow (prepared ones included) are closed so the next borrower starts clean,
+        broken connections (or _discard=True) are closed instead
+        """
+        if not _discard:
+            try:
+                db.rollback()
+                db.cur.close()
+                db.clear_stmt_cache()
+            except DB_ERRORS:
+                _discard = True
+
+        if _discard or self.closed:
+            try:
+                db.close()
+            except DB_ERRORS:
+                pass
+            with self.lock:
+                self.size -= 1
+        else:
+            self.idle.put(db)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a with block
+        """
+        db = self.acquire()
+        broken = False
+        try:
+            yield db
+        except DB_ERRORS:
+            broken = not db.ping()
+            raise
+        finally:
+            self.release(db, _discard=broken)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Borrow a connection and run the with block as a single transaction
+        """
+        with self.connection() as db:
+            with db.transaction():
+                yield db
+
+    def close(self):
+
+        self.closed = True
+        while True:
+            try:
+                db = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                db.close()
+            except DB_ERRORS:
+                pass
+            with self.lock:
+                self.size -= 1
+
+
+def benchmark(_rows=20000, _path=None):
+    """
+    Compare row-at-a-time and bulk write paths against a local SQLite stand-in
+    """
+    if _path is None:
+        fd, _path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+    stmt = "INSERT INTO bench (strand, slot, fitness) VALUES (?, ?, ?)"
+    rows = [(i // 100, i % 100, float(i)) for i in range(_rows)]
+
+    def row_commit(db):
+        for row in rows:
+            db.execute_stmt(stmt, row, _commit=True)
+
+    def row_single_commit(db):
+        for row in rows:
+            db.execute_stmt(stmt, row)
+        db.commit()
+
+    def executemany(db):
+        db.executemany(stmt, rows, _commit=True)
+
+    def multi_values(db):
+        db.insert_rows("bench", ("strand", "slot", "fitness"), rows, _commit=True)
+
+    def group_commit(db):
+        with db.batch(stmt, _maxRows=1000) as batch:
+            batch.extend(rows)
+
+    db = BeeDB(None, None, None, None, None, _connector=SQLiteStandIn(_path))
+    try:
+        for name, fn in (("row + commit", row_commit), ("row, single commit", row_single_commit),
+                         ("executemany", executemany), ("multi-row VALUES", multi_values),
+                         ("group commit batch", group_commit)):
+            db.execute_stmt("DROP TABLE IF EXISTS bench")
+            db.execute_stmt("CREATE TABLE bench (strand INTEGER, slot INTEGER, fitness DOUBLE)", _commit=True)
+            begin = time.perf_counter()
+            fn(db)
+            elapsed = time.perf_counter() - begin
+            print("[b] {:<20} : {:>8} rows in {:.3f}s - {:>10.0f} rows/s".format(name, _rows, elapsed, _rows / elapsed))
+    finally:
+        db.close()
+        removeDatabase(_path)
+
+
+if __name__ == "__main__":
+    # python BeeDB.py [rows]
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
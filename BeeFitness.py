@@ -0,0 +1,189 @@
+###############################################################################
+## Stigmee: A 3D browser and decentralized social network.
+## Copyright 2021 Duron Alain <duron.alain@gmail.com>
+##
+## This file is part of Stigmee.
+##
+## Project : Stigmee BeeBot
+## Version : 0.0-1
+## Date : 20-11-2021
+## Author : Alain Duron
+## File : BeeFitness.py
+##
+## Stigmee is free software: you can redistribute it and/or modify it
+## under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+
+# TODO:
+#   Batch the user (preference model) fitness as well
+
+import sys
+import math
+import timeit
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+Ranking metrics scoring a strand against the original ranking (the order the urls were returned in,
+ascending gene values), all minimized :
+
+- INV : the weighted inversion fitness of Strand.computeStrandFitness, value for value (it ignores the
+        last gene of the strand);
+- KEN : Kendall tau distance, the number of discordant pairs;
+- SPR : Spearman footrule, the sum of the displacements of the urls;
+- DCG : 1 - NDCG, urls being as relevant as they were ranked high originally.
+
+FitnessMetric scores one strand (it is a valid BeeVolve / Strand fitness function) or a whole batch
+of strands in one call, vectorized with numpy when it is installed.
+"""
+
+METRICS = ("INV", "KEN", "SPR", "DCG")
+
+
+class FitnessMetric:
+
+    def __init__(self, _metric="INV", _strandSize=21, _chunkSize=4096):
+        """
+        :param _metric: one of METRICS
+        :param _strandSize: number of genes of the strands
+        :param _chunkSize: number of strands evaluated at once by numpy (bounds the pairwise matrices)
+        """
+        if _metric not in METRICS:
+            raise ValueError("unknown fitness metric {}".format(_metric))
+        self.metric = _metric
+        self.strandSize = _strandSize
+        self.chunkSize = _chunkSize
+        # DCG discounts and ideal DCG (relevance strandSize - rank)
+        self.discounts = [1.0 / math.log2(pos + 2) for pos in range(_strandSize)]
+        self.idcg = sum((_strandSize - pos) * d for pos, d in enumerate(self.discounts))
+
+    def __call__(self, genes):
+
+        return self.score(genes)
+
+    @staticmethod
+    def ranks(genes):
+        """
+        rank of each gene in the original ranking (its rank among the genes of the strand)
+        """
+        order = sorted(range(len(genes)), key=genes.__getitem__)
+        ranks = [0] * len(genes)
+        for rank, pos in enumerate(order):
+            ranks[pos] = rank
+        return ranks
+
+    def score(self, genes):
+        """
+        returns the fitness of one strand (list of genes)
+        """
+        n = self.strandSize
+        if self.metric == "INV":
+            distances = 0
+            for i in range(0, n - 1):
+                distances += genes[i]
+                for j in range(i + 1, n - 1):
+                    if genes[i] > genes[j]:
+                        distances += genes[i] - genes[j]
+            return distances
+
+        ranks = self.ranks(genes[0:n])
+        if self.metric == "KEN":
+            return sum(1 for i in range(n) for j in range(i + 1, n) if ranks[i] > ranks[j])
+        if self.metric == "SPR":
+            return sum(abs(rank - pos) for pos, rank in enumerate(ranks))
+        dcg = sum((n - rank) * self.discounts[pos] for pos, rank in enumerate(ranks))
+        return 1.0 - dcg / self.idcg
+
+    def evaluate(self, strands):
+        """
+        returns the fitness of each strand of a batch, given as a sequence of gene lists
+        (or a popSize x strandSize integer array)
+        """
+        if np is None:
+            return [self.score(genes) for genes in strands]
+        if len(strands) == 0:
+            return []
+        matrix = np.asarray(strands, dtype=np.int64)[:, :self.strandSize]
+        fitness = [self.evaluateChunk(matrix[begin:begin + self.chunkSize])
+                   for begin in range(0, len(matrix), self.chunkSize)]
+        return np.concatenate(fitness).tolist() if fitness else []
+
+    def evaluateChunk(self, genes):
+
+        n = self.strandSize
+        if self.metric == "INV":
+            head = genes[:, :n - 1]
+            # pairs i < j of the first n - 1 genes, weighted by their distance when inverted
+            pairs = head[:, :, None] - head[:, None, :]
+            pairs *= np.triu(np.ones((n - 1, n - 1), dtype=bool), 1)
+            return head.sum(axis=1) + np.clip(pairs, 0, None).sum(axis=(1, 2))
+
+        ranks = np.argsort(np.argsort(genes, axis=1, kind="stable"), axis=1)
+        if self.metric == "KEN":
+            discordant = (ranks[:, :, None] > ranks[:, None, :]) & np.triu(np.ones((n, n), dtype=bool), 1)
+            return discordant.sum(axis=(1, 2))
+        if self.metric == "SPR":
+            return np.abs(ranks - np.arange(n)).sum(axis=1)
+        dcg = ((n - ranks) * np.asarray(self.discounts)).sum(axis=1)
+        return 1.0 - dcg / self.idcg
+
+
+def evaluateStrands(strands, metric):
+    """
+    Score Strand instances in one batch and set their fitness (see BeeVolve.newGenerationBatch)
+    """
+    for strand, fitness in zip(strands, metric.evaluate([strand.strandGenes for strand in strands])):
+        strand.strandFitness = fitness
+
+
+def benchmark(_sizes=(10000, 100000), _strandSize=21):
+    """
+    Strands scored per second one by one (Strand.computeStrandFitness for INV) and in batch, per metric
+    """
+    from BeeStrand import Strand
+
+    data = {gene: None for gene in range(_strandSize)}
+    print("[b] numpy {}".format("enabled" if np is not None else "not installed, pure Python batches"))
+    for size in _sizes:
+        strands = [Strand(_strandSize, data, None) for _ in range(size)]
+        genes = [strand.strandGenes for strand in strands]
+
+        begin = timeit.default_timer()
+        for strand in strands:
+            strand.computeStrandFitness()
+        t_strand = timeit.default_timer() - begin
+
+        for name in METRICS:
+            metric = FitnessMetric(name, _strandSize)
+            begin = timeit.default_timer()
+            fitness = metric.evaluate(genes)
+            t_batch = timeit.default_timer() - begin
+            if name == "INV":
+                assert fitness == [strand.getStrandFitness() for strand in strands]
+            begin = timeit.default_timer()
+            for g in genes[:1000]:
+                metric(g)
+            t_single = (timeit.default_timer() - begin) * size / 1000
+            print("[b] {:>7} strands - {} - one by one {:.0f}/s - batch {:.0f}/s{}".format(
+                size, name, size / t_single, size / t_batch,
+                " - Strand {:.0f}/s".format(size / t_strand) if name == "INV" else ""))
+
+
+if __name__ == "__main__":
+    # python BeeFitness.py [max batch size]
+    maxSize = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    benchmark(tuple(size for size in (10000, 100000) if size <= maxSize))
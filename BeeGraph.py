@@ -0,0 +1,281 @@
+###############################################################################
+## Stigmee: A 3D browser and decentralized social network.
+## Copyright 2021 Duron Alain <duron.alain@gmail.com>
+##
+## This file is part of Stigmee.
+##
+## Project : Stigmee BeeBot
+## Version : 0.0-1
+## Date : 20-11-2021
+## Author : Alain Duron
+## File : BeeGraph.py
+##
+## Stigmee is free software: you can redistribute it and/or modify it
+## under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+# TODO:
+#   Weight friendships (interaction counts) and preferences (recency)
+
+import sys
+import random
+import timeit
+from array import array
+
+"""
+SocialGraph is a compact in-memory friend graph in CSR form (compressed sparse rows) :
+the friends of user u are indices[indptr[u]:indptr[u + 1]]. A million users with ten friends
+each take about 100MB, instead of several GB as dictionaries of lists.
+"""
+class SocialGraph:
+
+    def __init__(self, _indptr, _indices):
+
+        self.indptr = _indptr       # array('q'), numUsers + 1 offsets
+        self.indices = _indices     # array('l'), friends of all users back to back
+        self.numUsers = len(_indptr) - 1
+
+    @classmethod
+    def fromEdges(cls, _numUsers, _src, _dst, _undirected=True):
+        """
+        Build the CSR arrays from two parallel sequences of user ids (counting sort, O(users + edges))
+        """
+        src = array('l', _src)
+        dst = array('l', _dst)
+        if _undirected:
+            src, dst = src + dst, dst + src
+
+        indptr = array('q', bytes(8 * (_numUsers + 1)))
+        for u in src:
+            indptr[u + 1] += 1
+        for u in range(_numUsers):
+            indptr[u + 1] += indptr[u]
+
+        indices = array('l', bytes(src.itemsize * len(src)))
+        fill = indptr[:-1]
+        for u, v in zip(src, dst):
+            indices[fill[u]] = v
+            fill[u] += 1
+        return cls(indptr, indices)
+
+    @classmethod
+    def fromFile(cls, _path, _undirected=True):
+        """
+        Load a "<user id> <friend id>" per line file
+        """
+        src = array('l')
+        dst = array('l')
+        with open(_path) as file:
+            for line in file:
+                if line.strip():
+                    u, v = line.split()
+                    src.append(int(u))
+                    dst.append(int(v))
+        numUsers = max(max(src, default=-1), max(dst, default=-1)) + 1
+        return cls.fromEdges(numUsers, src, dst, _undirected)
+
+    @classmethod
+    def fromDB(cls, _db, _table="bee_friends", _undirected=True):
+        """
+        Load the (user_id, friend_id) rows of a BeeDB table, streamed
+        """
+        src = array('l')
+        dst = array('l')
+        for u, v in _db.stream_query("SELECT user_id, friend_id FROM {}".format(_table)):
+            src.append(u)
+            dst.append(v)
+        numUsers = max(max(src, default=-1), max(dst, default=-1)) + 1
+        return cls.fromEdges(numUsers, src, dst, _undirected)
+
+    def friends(self, user):
+
+        return self.indices[self.indptr[user]:self.indptr[user + 1]]
+
+    def degree(self, user):
+
+        return self.indptr[user + 1] - self.indptr[user]
+
+
+"""
+RelationalIndex precomputes, per topic, what the friends of each user prefer : the strands (their
+url ids) they picked for that topic, laid out back to back as the CSR graph itself.
+Picking a strand a random friend of a user preferred is then a single random index, O(1),
+instead of a walk over the user's friends for every child. Aggregates are rebuilt in O(edges)
+when the preferences of a topic are refreshed.
+"""
+class RelationalIndex:
+
+    def __init__(self, _graph):
+
+        self.graph = _graph
+        self.topics = {}    # topic -> (aggIndptr, aggRefs, strands)
+        self.picks = 0
+        self.misses = 0     # users none of whose friends expressed a preference
+
+    def setPreferences(self, _topic, _preferred):
+        """
+        Preferences are kept against the strands themselves (their genes) rather than population slots,
+        which hold other strands as the population evolves
+        :param _preferred: strand (url ids) preferred by each user for the topic, None when none
+        """
+        graph = self.graph
+        indptr = graph.indptr
+        indices = graph.indices
+        strands = []        # distinct preferred strands, as tuples of url ids
+        refs = {}
+        preferred = array('l', [-1]) * graph.numUsers
+        for user, genes in enumerate(_preferred):
+            if genes is None or user >= graph.numUsers:
+                continue
+            genes = tuple(genes)
+            if not genes or min(genes) < 0:
+                raise ValueError("invalid strand preferred by user {} : {}".format(user, genes))
+            ref = refs.get(genes)
+            if ref is None:
+                ref = refs[genes] = len(strands)
+                strands.append(genes)
+            preferred[user] = ref
+
+        aggIndptr = array('q', bytes(8 * (graph.numUsers + 1)))
+        aggRefs = array('l')
+        for u in range(graph.numUsers):
+            aggRefs.extend(ref for ref in (preferred[v] for v in indices[indptr[u]:indptr[u + 1]]) if ref >= 0)
+            aggIndptr[u + 1] = len(aggRefs)
+        self.topics[_topic] = (aggIndptr, aggRefs, strands)
+
+    @staticmethod
+    def isRanking(genes, urls):
+        """
+        Whether genes order every url id of urls (a set) exactly once
+        """
+        return len(genes) == len(urls) and set(genes) == urls
+
+    def loadPreferences(self, _topic, _path, _urls=None):
+        """
+        Load a "<user id> <url id> <url id> ..." per line file (the genes of the preferred strand)
+        :param _urls: url ids of the topic, lines that are not a ranking of them are skipped
+        """
+        urls = set(_urls) if _urls is not None else None
+        preferred = [None] * self.graph.numUsers
+        with open(_path) as file:
+            for number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    user, *genes = (int(field) for field in line.split())
+                except ValueError:
+                    print("[!] {}:{} : invalid preference, skipped".format(_path, number))
+                    continue
+                if urls is not None and not self.isRanking(genes, urls):
+                    print("[!] {}:{} : not a ranking of the urls of {}, skipped".format(_path, number, _topic))
+                    continue
+                if user < self.graph.numUsers:
+                    preferred[user] = genes
+        self.setPreferences(_topic, preferred)
+
+    def loadPreferencesDB(self, _topic, _db, _table="bee_preferences", _urls=None):
+        """
+        Load the (user_id, genes) rows of a topic from a BeeDB table, streamed.
+        genes is a BeeStore.packGenes blob (int32 url ids)
+        :param _urls: url ids of the topic, rows that are not a ranking of them are skipped
+        """
+        urls = set(_urls) if _urls is not None else None
+        preferred = [None] * self.graph.numUsers
+        skipped = 0
+        for user, blob in _db.stream_query("SELECT user_id, genes FROM {} WHERE topic = ?".format(_table), (_topic,)):
+            genes = array('i')
+            genes.frombytes(bytes(blob))
+            if urls is not None and not self.isRanking(genes, urls):
+                skipped += 1
+            elif user < self.graph.numUsers:
+                preferred[user] = genes
+        if skipped:
+            print("[!] {} preferences of {} are not a ranking of its urls, skipped".format(skipped, _topic))
+        self.setPreferences(_topic, preferred)
+
+    def pick(self, _topic, _user):
+        """
+        returns the strand (tuple of url ids) preferred by a random friend of _user for _topic,
+        None if no friend has one
+        """
+        self.picks += 1
+        aggregate = self.topics.get(_topic)
+        if aggregate is None:
+            self.misses += 1
+            return None
+        aggIndptr, aggRefs, strands = aggregate
+        begin = aggIndptr[_user]
+        count = aggIndptr[_user + 1] - begin
+        if count == 0:
+            self.misses += 1
+            return None
+        return strands[aggRefs[begin + int(random.random() * count)]]
+
+    def walk(self, _topic, _user, _preferred):
+        """
+        Reference implementation of pick() walking the friends of _user, for benchmarks only
+        """
+        strands = [_preferred[v] for v in self.graph.friends(_user) if _preferred[v] is not None]
+        return random.choice(strands) if strands else None
+
+
+def syntheticGraph(_numUsers, _degree=10, _seed=None):
+    """
+    Random friend graph with _numUsers users and about _degree friends per user
+    """
+    rng = random.Random(_seed)
+    edges = _numUsers * _degree // 2
+    src = array('l', (rng.randrange(_numUsers) for _ in range(edges)))
+    dst = array('l', (rng.randrange(_numUsers) for _ in range(edges)))
+    return SocialGraph.fromEdges(_numUsers, src, dst)
+
+
+def benchmark(_sizes=(10000, 100000, 1000000), _degree=10, _popSize=200, _strandSize=21, _picks=200000):
+    """
+    Build time of the CSR graph and of the topic aggregates, and pick throughput of the
+    precomputed index against a walk over the friends per pick
+    """
+    for size in _sizes:
+        rng = random.Random(size)
+        begin = timeit.default_timer()
+        graph = syntheticGraph(size, _degree, _seed=size)
+        t_graph = timeit.default_timer() - begin
+
+        # Half of the users expressed a preference on the topic, for one of _popSize strands
+        strands = [tuple(rng.sample(range(_strandSize), _strandSize)) for _ in range(_popSize)]
+        preferred = [rng.choice(strands) if rng.random() < 0.5 else None for _ in range(size)]
+        index = RelationalIndex(graph)
+        begin = timeit.default_timer()
+        index.setPreferences("bench", preferred)
+        t_index = timeit.default_timer() - begin
+
+        users = [rng.randrange(size) for _ in range(_picks)]
+        begin = timeit.default_timer()
+        for user in users:
+            index.pick("bench", user)
+        t_pick = timeit.default_timer() - begin
+        begin = timeit.default_timer()
+        for user in users:
+            index.walk("bench", user, preferred)
+        t_walk = timeit.default_timer() - begin
+
+        memory = (graph.indptr.itemsize * len(graph.indptr) + graph.indices.itemsize * len(graph.indices)) / 2 ** 20
+        print("[b] users {:>8} - edges {:>9} ({:.0f}MB) - graph {:.2f}s - aggregates {:.2f}s - "
+              "pick {:.0f}/s - walk {:.0f}/s".format(size, len(graph.indices), memory, t_graph, t_index,
+                                                   _picks / t_pick, _picks / t_walk))
+
+
+if __name__ == "__main__":
+    # python BeeGraph.py [max users]
+    maxUsers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    benchmark(tuple(size for size in (10000, 100000, 1000000) if size <= maxUsers))
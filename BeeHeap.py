@@ -0,0 +1,144 @@
+###############################################################################
+## Stigmee: A 3D browser and decentralized social network.
+## Copyright 2021 Duron Alain <duron.alain@gmail.com>
+##
+## This file is part of Stigmee.
+##
+## Project : Stigmee BeeBot
+## Version : 0.0-1
+## Date : 20-11-2021
+## Author : Alain Duron
+## File : BeeHeap.py
+##
+## Stigmee is free software: you can redistribute it and/or modify it
+## under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+
+class IndexedHeap:
+    """
+    Binary min-heap of population slots keyed by a value, with a slot -> heap position index
+    so that the key of any slot can be changed in O(log n) (the heapq module can't).
+    """
+
+    def __init__(self, _size):
+
+        self.heap = []                  # slots, heap ordered by key
+        self.keys = [None] * _size      # key of each slot
+        self.pos = [-1] * _size         # position of each slot in heap, -1 if absent
+
+    def __len__(self):
+        return len(self.heap)
+
+    def peek(self):
+        """
+        returns (slot, key) of the minimum, O(1)
+        """
+        slot = self.heap[0]
+        return slot, self.keys[slot]
+
+    def set(self, slot, key):
+        """
+        Insert a slot or change its key, O(log n)
+        """
+        if slot >= len(self.pos):
+            missing = slot + 1 - len(self.pos)
+            self.pos.extend([-1] * missing)
+            self.keys.extend([None] * missing)
+        old = self.keys[slot]
+        self.keys[slot] = key
+        if self.pos[slot] < 0:
+            self.heap.append(slot)
+            self.pos[slot] = len(self.heap) - 1
+            self.siftUp(self.pos[slot])
+        elif key < old:
+            self.siftUp(self.pos[slot])
+        else:
+            self.siftDown(self.pos[slot])
+
+    def remove(self, slot):
+
+        i = self.pos[slot]
+        if i < 0:
+            return
+        last = self.heap.pop()
+        self.pos[slot] = -1
+        self.keys[slot] = None
+        if last != slot:
+            self.heap[i] = last
+            self.pos[last] = i
+            self.siftUp(i)
+            self.siftDown(self.pos[last])
+
+    def siftUp(self, i):
+
+        heap, keys, pos = self.heap, self.keys, self.pos
+        slot = heap[i]
+        key = keys[slot]
+        while i > 0:
+            parent = (i - 1) >> 1
+            if keys[heap[parent]] <= key:
+                break
+            heap[i] = heap[parent]
+            pos[heap[i]] = i
+            i = parent
+        heap[i] = slot
+        pos[slot] = i
+
+    def siftDown(self, i):
+
+        heap, keys, pos = self.heap, self.keys, self.pos
+        size = len(heap)
+        slot = heap[i]
+        key = keys[slot]
+        while True:
+            child = 2 * i + 1
+            if child >= size:
+                break
+            if child + 1 < size and keys[heap[child + 1]] < keys[heap[child]]:
+                child += 1
+            if keys[heap[child]] >= key:
+                break
+            heap[i] = heap[child]
+            pos[heap[i]] = i
+            i = child
+        heap[i] = slot
+        pos[slot] = i
+
+
+class FitnessIndex:
+    """
+    Keeps the population slots ordered by fitness both ways (minimization) :
+    best() and worst() in O(1), update() in O(log n)
+    """
+
+    def __init__(self, _popSize):
+
+        self.low = IndexedHeap(_popSize)    # fitness
+        self.high = IndexedHeap(_popSize)   # -fitness
+
+    def update(self, slot, fitness):
+
+        self.low.set(slot, fitness)
+        self.high.set(slot, -fitness)
+
+    def best(self):
+        """
+        returns (slot, fitness) of the fittest strand
+        """
+        return self.low.peek()
+
+    def worst(self):
+
+        slot, key = self.high.peek()
+        return slot, -key
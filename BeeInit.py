@@ -0,0 +1,196 @@
+###############################################################################
+## Stigmee: A 3D browser and decentralized social network.
+## Copyright 2021 Duron Alain <duron.alain@gmail.com>
+##
+## This file is part of Stigmee.
+##
+## Project : Stigmee BeeBot
+## Version : 0.0-1
+## Date : 20-11-2021
+## Author : Alain Duron
+## File : BeeInit.py
+##
+## Stigmee is free software: you can redistribute it and/or modify it
+## under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+
+# TODO:
+#   Warm start from the best strands of similar queries, not only of the same one
+
+import os
+import sys
+import random
+import hashlib
+import tempfile
+import shutil
+
+"""
+Seeded initialization : instead of starting every run cold from random permutations, the initial
+population can be built close to the original ranking (the order the search engine returned the
+urls in, which the test fitness measures the distance to) or from what previous runs of the same
+query found.
+
+- NNI : randomized nearest-neighbour insertion. Urls are taken in random order and each one is
+  inserted where it adds the least weighted inversion cost among a random sample of the positions,
+  so strands are good but still diverse;
+- ROT : rotations of the original ranking (Strand(_nni=True));
+- WRM : the best strands saved by the previous runs of the query, completed with NNI strands.
+  Fitness values are only comparable under the same fitness function, so strands are saved per
+  query and per metric (INV, KEN, SPR, DCG, or USR for user decisions).
+"""
+
+WARM_DIR = os.path.join("output", "warmstart")
+
+
+def insertionCosts(genes, gene):
+    """
+    returns the weighted inversion cost of inserting gene at each position 0..len(genes) of genes,
+    in O(len(genes)) : moving the insertion point past x removes the (gene - x) pair when x < gene
+    and adds the (x - gene) one when x > gene, both being a change of x - gene
+    """
+    cost = sum(gene - x for x in genes if x < gene)
+    costs = [cost]
+    for x in genes:
+        cost += x - gene
+        costs.append(cost)
+    return costs
+
+
+def nearestNeighbourInsertion(_genes, _greed=0.5, _rng=random):
+    """
+    returns a new ordering of _genes built by randomized insertion, O(n^2)
+    :param _greed: fraction of the positions considered for each insertion (1.0 : the cheapest one,
+                   which rebuilds the original ranking)
+    """
+    order = list(_genes)
+    _rng.shuffle(order)
+    genes = []
+    for gene in order:
+        costs = insertionCosts(genes, gene)
+        positions = len(costs)
+        sample = max(1, int(_greed * positions + 0.5))
+        if sample >= positions:
+            candidates = range(positions)
+        else:
+            candidates = _rng.sample(range(positions), sample)
+        genes.insert(min(candidates, key=costs.__getitem__), gene)
+    return genes
+
+
+class WarmStart:
+    """
+    Best strands of the previous runs of each query, one "<fitness> <gene> <gene> ..." per line file
+    per query and metric, fittest first
+    """
+
+    def __init__(self, _dir=WARM_DIR, _keep=20):
+
+        self.dir = _dir
+        self.keep = _keep
+
+    def path(self, query, metric):
+
+        return os.path.join(self.dir, "{}.{}.warm".format(hashlib.sha1(str(query).encode("utf-8")).hexdigest(), metric))
+
+    def entries(self, query, metric):
+        """
+        returns [(fitness, genes)] saved for a query and metric, fittest first
+        """
+        path = self.path(query, metric)
+        if not os.path.exists(path):
+            return []
+        entries = []
+        with open(path) as file:
+            for line in file:
+                fields = line.split()
+                if fields:
+                    entries.append((float(fields[0]), [int(gene) for gene in fields[1:]]))
+        return entries
+
+    def load(self, query, metric, genes):
+        """
+        returns the saved strands of a query that are orderings of genes (the url collection may
+        have changed since they were saved)
+        """
+        expected = sorted(genes)
+        return [saved for _, saved in self.entries(query, metric) if sorted(saved) == expected]
+
+    def save(self, query, metric, strands):
+        """
+        Merge the strands of this run with the ones saved before under the same metric, and keep the fittest
+        """
+        entries = self.entries(query, metric)
+        entries.extend((strand.getStrandFitness(), list(strand.strandGenes)) for strand in strands)
+        entries.sort(key=lambda entry: entry[0])
+
+        seen = set()
+        kept = []
+        for fitness, genes in entries:
+            if tuple(genes) not in seen:
+                seen.add(tuple(genes))
+                kept.append((fitness, genes))
+            if len(kept) >= self.keep:
+                break
+
+        if not os.path.exists(self.dir):
+            os.makedirs(self.dir)
+        path = self.path(query, metric)
+        with open(path + ".tmp", "w") as file:
+            for fitness, genes in kept:
+                print(fitness, *genes, file=file)
+        os.replace(path + ".tmp", path)
+
+
+def benchmark(_inputFile="test_urls.txt", _psize=100, _mutRate=0.05, _target=None, _maxIter=300, _runs=5,
+              _warmupIter=20):
+    """
+    Generations needed to reach _target (default : the optimum, the fitness of the original ranking)
+    from each initialization type. The seeded modes start close to it, a looser target would be met
+    before the first generation. The warm start is fed by a short random initialized run
+    (_warmupIter generations) of the same query before each of its runs.
+    """
+    from BeeVolve import BeeVolve
+    from BeeStrand import Strand
+
+    warmDir = tempfile.mkdtemp()
+    try:
+        for initType in ("RGS", "ROT", "NNI", "WRM"):
+            generations, initial = [], []
+            for run in range(_runs):
+                random.seed(run)
+                if initType == "WRM":
+                    shutil.rmtree(warmDir, ignore_errors=True)
+                    warmup = BeeVolve(_inputFile, _psize, _mutRate, _warmupIter, "RGS", "SIM", "BIN", "SCR",
+                                      _warmDir=warmDir)
+                    warmup.run()
+                volve = BeeVolve(_inputFile, _psize, _mutRate, _maxIter, initType, "SIM", "BIN", "SCR",
+                                 _warmDir=warmDir)
+                if _target is None:
+                    _target = Strand(volve.strandSize, volve.data, sorted(volve.data)).getStrandFitness()
+                initial.append(volve.best.getStrandFitness())
+                while volve.best.getStrandFitness() > _target and volve.step():
+                    pass
+                generations.append(volve.iteration)
+            print("[b] {} - initial best {:.1f} - generations to {} : {:.1f} (min {}, max {})".format(
+                initType, sum(initial) / _runs, _target, sum(generations) / _runs, min(generations),
+                max(generations)))
+    finally:
+        shutil.rmtree(warmDir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # python BeeInit.py [file] [target fitness]
+    inputFile = sys.argv[1] if len(sys.argv) > 1 else "test_urls.txt"
+    target = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    benchmark(inputFile, _target=target)
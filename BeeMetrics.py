@@ -0,0 +1,327 @@
+###############################################################################
+## Stigmee: A 3D browser and decentralized social network.
+## Copyright 2021 Duron Alain <duron.alain@gmail.com>
+##
+## This file is part of Stigmee.
+##
+## Project : Stigmee BeeBot
+## Version : 0.0-1
+## Date : 20-11-2021
+## Author : Alain Duron
+## File : BeeMetrics.py
+##
+## Stigmee is free software: you can redistribute it and/or modify it
+## under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+
+# TODO:
+#   Unix socket endpoint for hosts where no port can be opened
+
+import os
+import sys
+import timeit
+import threading
+from bisect import bisect_left
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from BeeStrand import Strand, FitnessCache
+
+"""
+Live telemetry of a run in the Prometheus text format (http://<host>:<port>/metrics).
+
+The generation loop only does plain attribute updates (counters, gauges, one bucket increment per
+histogram observation) and is the only writer, the exporter thread only reads : no lock is taken,
+a scrape may just see the values of a generation being updated. Cache hit ratios and the memory
+use are computed when scraped. Rates are left to the server (rate(bee_generations_total[1m])) :
+a scrape does not change any state, so several scrapers do not disturb each other.
+"""
+
+PHASES = ("selection", "crossover", "mutation")
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def formatLabels(labels):
+
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, value) for key, value in sorted(labels.items())) + "}"
+
+
+class Counter:
+
+    def __init__(self, _labels=None):
+
+        self.labels = _labels
+        self.value = 0
+
+    def inc(self, _amount=1):
+
+        self.value += _amount
+
+    def samples(self, name):
+
+        yield name + formatLabels(self.labels), self.value
+
+
+class Gauge:
+    """
+    A value set by the loop, or computed by _fn when scraped
+    """
+
+    def __init__(self, _labels=None, _fn=None):
+
+        self.labels = _labels
+        self.fn = _fn
+        self.value = 0
+
+    def set(self, value):
+
+        self.value = value
+
+    def samples(self, name):
+
+        value = self.fn() if self.fn is not None else self.value
+        if value is not None:
+            yield name + formatLabels(self.labels), value
+
+
+class Histogram:
+
+    def __init__(self, _buckets=LATENCY_BUCKETS, _labels=None):
+
+        self.labels = _labels
+        self.buckets = tuple(_buckets)
+        self.counts = [0] * (len(self.buckets) + 1)     # per bucket, the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name):
+
+        labels = dict(self.labels or {})
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), list(self.counts)):
+            cumulative += count
+            labels["le"] = bound
+            yield name + "_bucket" + formatLabels(labels), cumulative
+        yield name + "_sum" + formatLabels(self.labels), self.sum
+        yield name + "_count" + formatLabels(self.labels), cumulative
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+
+        self.families = {}  # name -> [type, help, metrics]
+
+    def register(self, kind, name, help, metric):
+
+        family = self.families.setdefault(name, [kind, help, []])
+        family[2].append(metric)
+        return metric
+
+    def counter(self, name, help, _labels=None):
+
+        return self.register("counter", name, help, Counter(_labels))
+
+    def gauge(self, name, help, _labels=None, _fn=None):
+
+        return self.register("gauge", name, help, Gauge(_labels, _fn))
+
+    def histogram(self, name, help, _labels=None, _buckets=LATENCY_BUCKETS):
+
+        return self.register("histogram", name, help, Histogram(_buckets, _labels))
+
+    def render(self):
+        """
+        returns the Prometheus text exposition of all the metrics
+        """
+        lines = []
+        for name, (kind, help, metrics) in self.families.items():
+            lines.append("# HELP {} {}".format(name, help))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for metric in metrics:
+                for sample, value in metric.samples(name):
+                    lines.append("{} {}".format(sample, float(value)))
+        return "\n".join(lines) + "\n"
+
+
+def residentMemory():
+    """
+    returns the resident set size of the process in bytes (None where /proc is not available)
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class VolveMetrics:
+    """
+    Metrics of a BeeVolve run, updated once per generation by BeeVolve.step(), SurrogateVolve.step()
+    or StigmerService.applyBatch() (a micro-generation)
+    """
+
+    def __init__(self, _registry=None):
+
+        registry = _registry if _registry is not None else MetricsRegistry()
+        self.registry = registry
+        self.volve = None
+
+        self.generations = registry.counter("bee_generations_total", "Generations (or steady-state steps) done")
+        self.children = registry.counter("bee_children_total", "Children bred")
+        self.generationTime = registry.histogram("bee_generation_seconds", "Duration of a generation")
+        self.phaseTime = {phase: registry.histogram("bee_phase_seconds", "Time spent per phase in a generation",
+                                                    _labels={"phase": phase}) for phase in PHASES}
+        self.bestFitness = registry.gauge("bee_best_fitness", "Fitness of the best strand found so far")
+        self.poolFitness = registry.gauge("bee_pool_fitness", "Best fitness of the mating pool")
+
+        registry.gauge("bee_cache_hit_ratio", "Hit ratio of the caches", _labels={"cache": "fitness"},
+                       _fn=lambda: self.hitRatio(self.fitnessCache()))
+        registry.gauge("bee_cache_hit_ratio", "Hit ratio of the caches", _labels={"cache": "population"},
+                       _fn=lambda: self.hitRatio(self.populationCache()))
+        registry.gauge("bee_cache_hit_ratio", "Hit ratio of the caches", _labels={"cache": "statement"},
+                       _fn=self.statementRatio)
+        registry.gauge("bee_resident_memory_bytes", "Resident set size of the process", _fn=residentMemory)
+
+    def attach(self, volve):
+
+        self.volve = volve
+
+    def fitnessCache(self):
+
+        return Strand.fitnessCache
+
+    def populationCache(self):
+
+        volve = self.volve
+        return volve.population if volve is not None and volve.store is not None else None
+
+    @staticmethod
+    def hitRatio(cache, _hits="hits", _misses="misses"):
+
+        if cache is None:
+            return None
+        hits, misses = getattr(cache, _hits), getattr(cache, _misses)
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    def statementRatio(self):
+
+        volve = self.volve
+        if volve is None or volve.store is None:
+            return None
+        return self.hitRatio(volve.store.db, "stmtHits", "stmtMisses")
+
+    def generation(self, volve, elapsed, _children=None):
+        """
+        Record a generation, from the statistics row BeeVolve appended for it
+        :param _children: children bred in the generation (default : the steady-state step or population size)
+        """
+        self.generations.inc()
+        if _children is None:
+            _children = volve.steadyState if volve.steadyState is not None else volve.popSize
+        self.children.inc(_children)
+        self.generationTime.observe(elapsed)
+        if volve.stat_board:
+            stat = volve.stat_board[-1]
+            for i, phase in enumerate(PHASES):
+                self.phaseTime[phase].observe(stat[i])
+            self.poolFitness.set(stat[4])
+        self.bestFitness.set(volve.best.getStrandFitness())
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are not worth a line on stderr each
+        pass
+
+
+class MetricsServer:
+    """
+    Serves a registry on http://<_host>:<_port>/metrics from a daemon thread
+    """
+
+    def __init__(self, _registry, _port=9464, _host="127.0.0.1"):
+
+        self.httpd = HTTPServer((_host, _port), MetricsHandler)
+        self.httpd.registry = _registry
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="bee-metrics", daemon=True)
+
+    def start(self):
+
+        self.thread.start()
+        return self
+
+    def stop(self):
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def benchmark(_inputFile="test_urls.txt", _psize=200, _maxIter=100, _calls=100000):
+    """
+    Cost of the per generation metrics update against the duration of a generation, and a scrape
+    of the endpoint while the run is served
+    """
+    import urllib.request
+    from BeeVolve import BeeVolve
+
+    Strand.fitnessCache = FitnessCache(1 << 16)
+    metrics = VolveMetrics()
+    server = MetricsServer(metrics.registry, _port=0).start()
+    try:
+        volve = BeeVolve(_inputFile, _psize, 0.05, _maxIter, "RGS", "SIM", "BIN", "SCR", _metrics=metrics)
+        volve.run()
+        generation = metrics.generationTime.sum / metrics.generationTime.count
+
+        begin = timeit.default_timer()
+        with urllib.request.urlopen("http://127.0.0.1:{}/metrics".format(server.port)) as response:
+            exposition = response.read().decode("utf-8")
+        scrape = timeit.default_timer() - begin
+    finally:
+        server.stop()
+
+    begin = timeit.default_timer()
+    for _ in range(_calls):
+        metrics.generation(volve, generation)
+    update = (timeit.default_timer() - begin) / _calls
+    print("[b] generation {:.2f}ms - metrics update {:.2f}us ({:.4f}% of a generation) - scrape {:.2f}ms".format(
+        generation * 1e3, update * 1e6, 100.0 * update / generation, scrape * 1e3))
+    for line in exposition.splitlines():
+        if not line.startswith("#") and "_bucket" not in line:
+            print("    " + line)
+
+
+if __name__ == "__main__":
+    # python BeeMetrics.py [file]
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else "test_urls.txt")
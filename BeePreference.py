@@ -0,0 +1,165 @@
+###############################################################################
+## Stigmee: A 3D browser and decentralized social network.
+## Copyright 2021 Duron Alain <duron.alain@gmail.com>
+##
+## This file is part of Stigmee.
+##
+## Project : Stigmee BeeBot
+## Version : 0.0-1
+## Date : 20-11-2021
+## Author : Alain Duron
+## File : BeePreference.py
+##
+## Stigmee is free software: you can redistribute it and/or modify it
+## under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+import os
+import math
+import struct
+from array import array
+
+"""
+PreferenceModel aggregates user decisions into one score per url id, updated online
+(Bradley-Terry model fitted by stochastic gradient, the same update as an Elo rating).
+
+Each user decision is a partial ranking of the urls shown : accepted urls beat the neutral and
+rejected ones, neutral urls beat the rejected ones. Instead of one update per pair of urls, each
+pair of groups gets a single gradient step, the outcome probability being taken between the mean
+scores of the groups : a vote costs O(urls shown), whatever the vote history. Strand fitness is
+then an O(strandSize) lookup of the scores of its genes weighted by their display position.
+
+Scores live in compact arrays and can be snapshotted to disk for fast restarts.
+"""
+
+SNAPSHOT_MAGIC = b"BEEP"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = "<4sIdI"  # magic, version, learning rate, number of urls
+
+
+class PreferenceModel:
+
+    def __init__(self, _size, _strandSize=21, _learningRate=0.1):
+        """
+        :param _size: number of url ids (ids go from 0 to _size - 1), grows on demand
+        :param _strandSize: number of genes of the strands to evaluate
+        :param _learningRate: step of the online updates (Elo K-factor on a logistic scale)
+        """
+        self.learningRate = _learningRate
+        self.scores = array('d', bytes(8 * _size))     # log-strength of each url
+        self.counts = array('l', bytes(array('l').itemsize * _size))  # comparisons each url took part in
+        self.setStrandSize(_strandSize)
+        self.updates = 0
+
+    def setStrandSize(self, _strandSize):
+
+        self.strandSize = _strandSize
+        self.weights = [1.0 / (pos + 1) for pos in range(_strandSize)]
+
+    def grow(self, _size):
+
+        if _size > len(self.scores):
+            missing = _size - len(self.scores)
+            self.scores.frombytes(bytes(8 * missing))
+            self.counts.frombytes(bytes(self.counts.itemsize * missing))
+
+    def update(self, winner, loser):
+        """
+        One pairwise outcome : winner was preferred to loser
+        """
+        scores = self.scores
+        # Probability the model gave to the observed outcome
+        p = 1.0 / (1.0 + math.exp(scores[loser] - scores[winner]))
+        step = self.learningRate * (1.0 - p)
+        scores[winner] += step
+        scores[loser] -= step
+        self.counts[winner] += 1
+        self.counts[loser] += 1
+        self.updates += 1
+
+    def updateGroups(self, winners, losers):
+        """
+        Every url of winners was preferred to every url of losers : one aggregated step, each url
+        moving by as much as its pairwise updates would have added up to (probability between means)
+        """
+        if not winners or not losers:
+            return
+        scores = self.scores
+        meanWinner = sum(scores[gene] for gene in winners) / len(winners)
+        meanLoser = sum(scores[gene] for gene in losers) / len(losers)
+        step = self.learningRate * (1.0 - 1.0 / (1.0 + math.exp(meanLoser - meanWinner)))
+        for gene in winners:
+            scores[gene] += step * len(losers)
+            self.counts[gene] += len(losers)
+        for gene in losers:
+            scores[gene] -= step * len(winners)
+            self.counts[gene] += len(winners)
+        self.updates += 1
+
+    def recordDecision(self, accepted, rejected, shown=None):
+        """
+        A user decision over the urls shown : accepted > neutral (shown, neither accepted nor rejected) > rejected
+        """
+        size = max(max(accepted, default=-1), max(rejected, default=-1), max(shown or (), default=-1)) + 1
+        self.grow(size)
+        neutral = []
+        if shown is not None:
+            decided = set(accepted) | set(rejected)
+            neutral = [gene for gene in shown if gene not in decided]
+        self.updateGroups(accepted, rejected)
+        self.updateGroups(accepted, neutral)
+        self.updateGroups(neutral, rejected)
+
+    def score(self, gene):
+
+        return self.scores[gene] if gene < len(self.scores) else 0.0
+
+    def strandFitness(self, genes):
+        """
+        Minimization (as the test inversion metric) : the preferred urls should be shown first
+        """
+        scores = self.scores
+        return -sum(scores[gene] * weight for gene, weight in zip(genes, self.weights))
+
+    def ranking(self):
+        """
+        returns the url ids sorted from the most to the least preferred
+        """
+        return sorted(range(len(self.scores)), key=lambda gene: -self.scores[gene])
+
+    def save(self, _path):
+        """
+        Snapshot the model, written to a temporary file first so a crash never leaves a truncated snapshot
+        """
+        tmp = _path + ".tmp"
+        with open(tmp, "wb") as file:
+            file.write(struct.pack(SNAPSHOT_HEADER, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.learningRate,
+                                   len(self.scores)))
+            self.scores.tofile(file)
+            array('q', self.counts).tofile(file)
+        os.replace(tmp, _path)
+
+    @classmethod
+    def load(cls, _path, _strandSize=21):
+
+        with open(_path, "rb") as file:
+            magic, version, learningRate, size = struct.unpack(SNAPSHOT_HEADER,
+                                                               file.read(struct.calcsize(SNAPSHOT_HEADER)))
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                raise ValueError("{} is not a preference model snapshot".format(_path))
+            model = cls(0, _strandSize, learningRate)
+            model.scores.fromfile(file, size)
+            counts = array('q')
+            counts.fromfile(file, size)
+            model.counts = array('l', counts)
+        return model
@@ -0,0 +1,293 @@
+###############################################################################
+## Stigmee: A 3D browser and decentralized social network.
+## Copyright 2021 Duron Alain <duron.alain@gmail.com>
+##
+## This file is part of Stigmee.
+##
+## Project : Stigmee BeeBot
+## Version : 0.0-1
+## Date : 20-11-2021
+## Author : Alain Duron
+## File : BeeSession.py
+##
+## Stigmee is free software: you can redistribute it and/or modify it
+## under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+# TODO:
+#   Spread sessions over a pool of worker processes (see BeeShm for zero-copy populations)
+
+import heapq
+import pickle
+import hashlib
+from contextlib import contextmanager
+from BeeVolve import *
+
+"""
+SessionManager hosts many BeeVolve populations, one per search topic, in a single process :
+
+- a fair scheduler advances the session that consumed the least CPU time so far (virtual runtime,
+  as the Linux CFS) by as many generations as fit in a time slice, so small and large populations
+  progress at the same pace and no topic starves;
+- url strings are interned once for all sessions, and the test fitness values are shared through
+  the manager's FitnessCache (every topic uses url ids 0..strandSize-1, so strands with the same
+  genes have the same inversion fitness whatever the topic). Strand.fitnessCache is process wide :
+  the manager only installs its cache while it runs session code, and puts the previous one back;
+- sessions without user activity for a while, or beyond the number of loaded sessions allowed,
+  are pickled to disk and reloaded transparently on their next use.
+"""
+
+
+class BeeSession:
+
+    def __init__(self, _topic, _volve):
+
+        self.topic = _topic
+        self.volve = _volve         # None while evicted
+        self.spoolFile = None
+        self.vruntime = 0.0         # CPU time consumed, the scheduler runs the lowest first
+        self.lastUsed = timeit.default_timer()
+        self.generations = 0
+        self.finished = False       # All generations done (known even while evicted)
+
+    def done(self):
+
+        if self.volve is not None:
+            self.finished = self.volve.iteration >= self.volve.maxIter
+        return self.finished
+
+
+class SessionManager:
+
+    def __init__(self, _sliceTime=0.02, _maxLoaded=200, _idleTimeout=300.0, _spoolDir="output/sessions",
+                 _cacheSize=1 << 20):
+        """
+        :param _sliceTime: CPU time (s) a session may use before the scheduler moves on (at least one generation)
+        :param _maxLoaded: maximum number of sessions kept in memory, the least recently used are evicted
+        :param _idleTimeout: seconds without user activity before a session is evicted to disk
+        :param _spoolDir: where evicted sessions are stored
+        :param _cacheSize: size of the fitness cache shared by all sessions (0 to disable it)
+        """
+        self.sliceTime = _sliceTime
+        self.maxLoaded = _maxLoaded
+        self.idleTimeout = _idleTimeout
+        self.spoolDir = _spoolDir
+
+        self.sessions = {}          # topic -> BeeSession
+        self.runqueue = []          # heap of (vruntime, sequence, topic)
+        self.sequence = 0
+        self.urls = {}              # url interning table shared by all sessions
+        self.loaded = 0
+        self.evictions = 0
+        self.restores = 0
+
+        self.fitnessCache = FitnessCache(_cacheSize) if _cacheSize else None
+        if not os.path.exists(self.spoolDir):
+            os.makedirs(self.spoolDir)
+
+    @contextmanager
+    def cacheScope(self):
+        """
+        Install the fitness cache of the manager for the duration of the block
+        """
+        previous = Strand.fitnessCache
+        Strand.fitnessCache = self.fitnessCache
+        try:
+            yield
+        finally:
+            Strand.fitnessCache = previous
+
+    def intern(self, data):
+        """
+        Share the url strings of a {url id: url} collection with the other sessions
+        """
+        return {id: self.urls.setdefault(url, url) for id, url in data.items()}
+
+    def minRuntime(self):
+
+        return self.runqueue[0][0] if self.runqueue else 0.0
+
+    def schedule(self, session):
+
+        self.sequence += 1
+        heapq.heappush(self.runqueue, (session.vruntime, self.sequence, session.topic))
+
+    def openSession(self, _topic, _data, _psize=100, _mutRate=0.05, _maxIter=1000, _strandSize=21,
+                    _apct=20, _xpct=None, _slctType="BIN", _mutnType="SCR", _bestOnly=False):
+        """
+        Host a new population for a topic, _data being its {url id: url} collection (eg. search results)
+        """
+        if _topic in self.sessions:
+            return self.touch(_topic)
+        with self.cacheScope():
+            volve = BeeVolve(None, _psize, _mutRate, _maxIter, "RGS", "SIM", _slctType, _mutnType,
+                             _strandSize, _apct, _xpct, _bestOnly=_bestOnly, _query=_topic,
+                             _data=self.intern(_data))
+        session = BeeSession(_topic, volve)
+        # Start level with the others, a newcomer must not monopolize the process
+        session.vruntime = self.minRuntime()
+        self.sessions[_topic] = session
+        self.loaded += 1
+        self.schedule(session)
+        self.evictOverflow()
+        return session
+
+    def closeSession(self, _topic):
+
+        session = self.sessions.pop(_topic)
+        if session.volve is not None:
+            self.loaded -= 1
+        if session.spoolFile is not None and os.path.exists(session.spoolFile):
+            os.remove(session.spoolFile)
+        # its run queue entry is dropped lazily
+
+    def touch(self, _topic):
+        """
+        User activity on a topic : reload its session if needed and keep it from being evicted
+        """
+        session = self.sessions[_topic]
+        session.lastUsed = timeit.default_timer()
+        if session.volve is None:
+            self.restore(session)
+        return session
+
+    def best(self, _topic):
+        """
+        returns the best strand of a topic as a list of urls
+        """
+        volve = self.touch(_topic).volve
+        return [volve.data[gene] for gene in volve.best.strandGenes]
+
+    def spoolPath(self, topic):
+
+        return os.path.join(self.spoolDir, hashlib.sha1(topic.encode("utf-8")).hexdigest() + ".session")
+
+    def evict(self, session):
+        """
+        Pickle the session population to disk and release its memory
+        """
+        volve = session.volve
+        session.done()
+        # Shared or external objects are not part of the session state
+        detached = (volve.outfile, volve.store, volve.relational, volve.metrics)
+        volve.outfile, volve.store, volve.relational, volve.metrics = None, None, None, None
+        session.spoolFile = self.spoolPath(session.topic)
+        with open(session.spoolFile + ".tmp", "wb") as file:
+            pickle.dump(volve, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(session.spoolFile + ".tmp", session.spoolFile)
+        volve.outfile, volve.store, volve.relational, volve.metrics = detached
+        session.volve = None
+        self.loaded -= 1
+        self.evictions += 1
+
+    def restore(self, session):
+
+        with open(session.spoolFile, "rb") as file:
+            volve = pickle.load(file)
+        volve.data = self.intern(volve.data)
+        for strands in (volve.population, volve.matingPool, [volve.best]):
+            for strand in strands:
+                strand.origGenes = volve.data
+        session.volve = volve
+        self.loaded += 1
+        self.restores += 1
+        if not session.done():
+            session.vruntime = max(session.vruntime, self.minRuntime())
+            self.schedule(session)
+        self.evictOverflow(_keep=session)
+
+    def evictOverflow(self, _keep=None):
+
+        if self.loaded <= self.maxLoaded:
+            return
+        loaded = sorted((s for s in self.sessions.values() if s.volve is not None and s is not _keep),
+                        key=lambda s: s.lastUsed)
+        for session in loaded[:self.loaded - self.maxLoaded]:
+            self.evict(session)
+
+    def evictIdle(self):
+
+        now = timeit.default_timer()
+        for session in list(self.sessions.values()):
+            if session.volve is not None and now - session.lastUsed > self.idleTimeout:
+                self.evict(session)
+
+    def step(self):
+        """
+        Run one time slice of the session with the lowest virtual runtime.
+        returns False when no session has generations left to run
+        """
+        while self.runqueue:
+            _, _, topic = heapq.heappop(self.runqueue)
+            session = self.sessions.get(topic)
+            # stale entries : closed, evicted (rescheduled on restore) or finished sessions
+            if session is None or session.volve is None or session.done():
+                continue
+            begin = timeit.default_timer()
+            with self.cacheScope():
+                while session.volve.step():
+                    session.generations += 1
+                    if timeit.default_timer() - begin >= self.sliceTime:
+                        break
+            session.vruntime += timeit.default_timer() - begin
+            if not session.done():
+                self.schedule(session)
+            return True
+        return False
+
+    def run(self, _duration=None):
+        """
+        Advance the sessions until they are all done (or evicted), or for _duration seconds
+        """
+        begin = timeit.default_timer()
+        lastCheck = begin
+        while self.step():
+            now = timeit.default_timer()
+            if now - lastCheck >= 1.0:
+                self.evictIdle()
+                lastCheck = now
+            if _duration is not None and now - begin >= _duration:
+                break
+
+    def stats(self):
+
+        cache = self.fitnessCache
+        return {"sessions": len(self.sessions), "loaded": self.loaded, "evictions": self.evictions,
+                "restores": self.restores, "interned_urls": len(self.urls),
+                "generations": sum(s.generations for s in self.sessions.values()),
+                "cache_hits": cache.hits if cache else 0, "cache_misses": cache.misses if cache else 0}
+
+
+if __name__ == "__main__":
+    # python BeeSession.py [topics] [file] : one population per topic, all built from the same url file
+    topics = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    inputFile = sys.argv[2] if len(sys.argv) > 2 else "test_urls.txt"
+    with open(inputFile) as file:
+        urls = dict((int(id), url) for id, url in (line.split() for line in file if line.strip()))
+
+    manager = SessionManager(_maxLoaded=max(1, topics // 2))
+    begin = timeit.default_timer()
+    for t in range(topics):
+        manager.openSession("topic {}".format(t), urls, _psize=50, _maxIter=20)
+    while True:
+        manager.run()
+        # Users coming back to the topics that were evicted before they were done
+        pending = [topic for topic, session in manager.sessions.items() if session.volve is None and not session.finished]
+        if not pending:
+            break
+        for topic in pending[:manager.maxLoaded]:
+            manager.touch(topic)
+    elapsed = timeit.default_timer() - begin
+    stats = manager.stats()
+    print("[b] {} sessions in {:.2f}s - {:.0f} generations/s - {}".format(topics, elapsed,
+                                                                         stats["generations"] / elapsed, stats))
@@ -0,0 +1,209 @@
+###############################################################################
+## Stigmee: A 3D browser and decentralized social network.
+## Copyright 2021 Duron Alain <duron.alain@gmail.com>
+##
+## This file is part of Stigmee.
+##
+## Project : Stigmee BeeBot
+## Version : 0.0-1
+## Date : 20-11-2021
+## Author : Alain Duron
+## File : BeeShm.py
+##
+## Stigmee is free software: you can redistribute it and/or modify it
+## under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+# TODO:
+#   Run selection / crossover / mutation in the workers too, not only the evaluation
+
+import sys
+import pickle
+import timeit
+import multiprocessing
+from array import array
+from multiprocessing import shared_memory
+from BeeStrand import *
+
+"""
+SharedPopulation keeps a population in a shared memory block that worker processes attach to :
+a popSize x strandSize int32 genes matrix followed by a float64 fitness vector. Workers read and
+write rows in place, only slot ranges go through the pipes, where exchanging Strand objects would
+pickle their genes and their whole origGenes url dictionary on every exchange.
+"""
+class SharedPopulation:
+
+    def __init__(self, _popSize, _strandSize, _name=None):
+        """
+        Create a new block, or attach to the block called _name
+        """
+        self.popSize = _popSize
+        self.strandSize = _strandSize
+        self.genesBytes = 4 * _popSize * _strandSize
+        # Keep the fitness vector 8 bytes aligned
+        self.fitnessOffset = (self.genesBytes + 7) & ~7
+        size = self.fitnessOffset + 8 * _popSize
+
+        self.owner = _name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            # Pool workers share the resource tracker of their parent : the block stays owned
+            # (and unlinked) by its creator only
+            self.shm = shared_memory.SharedMemory(name=_name)
+        self.name = self.shm.name
+        self.genes = self.shm.buf[:self.genesBytes].cast('i')
+        self.fitness = self.shm.buf[self.fitnessOffset:self.fitnessOffset + 8 * _popSize].cast('d')
+
+    def getGenes(self, slot):
+
+        begin = slot * self.strandSize
+        return self.genes[begin:begin + self.strandSize].tolist()
+
+    def setGenes(self, slot, genes):
+
+        begin = slot * self.strandSize
+        self.genes[begin:begin + self.strandSize] = array('i', genes[0:self.strandSize])
+
+    def store(self, slot, strand):
+
+        self.setGenes(slot, strand.strandGenes)
+        self.fitness[slot] = strand.getStrandFitness()
+
+    def load(self, slot, data):
+        """
+        returns the strand of a slot, built over the {url id: url} collection data
+        """
+        return Strand(self.strandSize, data, self.getGenes(slot), _fitness=self.fitness[slot])
+
+    def storePopulation(self, strands):
+
+        for slot, strand in enumerate(strands):
+            self.store(slot, strand)
+
+    def close(self):
+
+        # memoryviews must be released before the block can be closed
+        self.genes.release()
+        self.fitness.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# Worker side : the block is attached once per worker process, by the pool initializer
+workerPopulation = None
+
+
+def attachWorker(name, popSize, strandSize):
+
+    global workerPopulation
+    workerPopulation = SharedPopulation(popSize, strandSize, _name=name)
+
+
+def evaluateSlots(bounds):
+    """
+    Compute in place the test fitness of the slots [start, stop) of the shared population
+    """
+    start, stop = bounds
+    population = workerPopulation
+    for slot in range(start, stop):
+        genes = population.getGenes(slot)
+        population.fitness[slot] = Strand(population.strandSize, {}, genes).getStrandFitness()
+    return stop - start
+
+
+def evaluateStrands(strands):
+    """
+    Pickle-based counterpart of evaluateSlots : strands travel to the worker and fitness values back
+    """
+    for strand in strands:
+        strand.computeStrandFitness()
+    return [strand.getStrandFitness() for strand in strands]
+
+
+class SharedEvaluator:
+    """
+    Pool of worker processes evaluating a SharedPopulation in place
+    """
+
+    def __init__(self, _population, _workers=None):
+
+        self.population = _population
+        self.workers = _workers or multiprocessing.cpu_count()
+        self.pool = multiprocessing.Pool(self.workers, initializer=attachWorker,
+                                         initargs=(_population.name, _population.popSize, _population.strandSize))
+
+    def ranges(self, start, stop):
+
+        chunk = max(1, (stop - start + self.workers * 4 - 1) // (self.workers * 4))
+        return [(i, min(i + chunk, stop)) for i in range(start, stop, chunk)]
+
+    def evaluate(self, _start=0, _stop=None):
+
+        stop = self.population.popSize if _stop is None else _stop
+        return sum(self.pool.map(evaluateSlots, self.ranges(_start, stop)))
+
+    def close(self):
+
+        self.pool.close()
+        self.pool.join()
+
+
+def benchmark(_sizes=(1000, 10000, 100000), _inputFile="test_urls.txt", _strandSize=21, _workers=None):
+    """
+    Evaluate whole populations with worker processes, exchanging pickled Strand objects
+    or slot ranges over a SharedPopulation
+    """
+    with open(_inputFile) as file:
+        data = dict((int(id), url) for id, url in (file.readline().split() for _ in range(_strandSize)))
+    workers = _workers or multiprocessing.cpu_count()
+
+    for size in _sizes:
+        strands = [Strand(_strandSize, data, None) for _ in range(size)]
+        expected = [strand.getStrandFitness() for strand in strands]
+
+        # Pickle-based exchange
+        chunk = max(1, size // (workers * 4))
+        chunks = [strands[i:i + chunk] for i in range(0, size, chunk)]
+        transferred = sum(len(pickle.dumps(c, protocol=pickle.HIGHEST_PROTOCOL)) for c in chunks)
+        with multiprocessing.Pool(workers) as pool:
+            begin = timeit.default_timer()
+            fitness = [f for result in pool.map(evaluateStrands, chunks) for f in result]
+            t_pickle = timeit.default_timer() - begin
+        assert fitness == expected
+
+        # Shared memory exchange
+        population = SharedPopulation(size, _strandSize)
+        population.storePopulation(strands)
+        for slot in range(size):
+            population.fitness[slot] = 0
+        evaluator = SharedEvaluator(population, workers)
+        try:
+            ranges = evaluator.ranges(0, size)
+            begin = timeit.default_timer()
+            evaluator.evaluate()
+            t_shm = timeit.default_timer() - begin
+            assert population.fitness.tolist() == expected
+        finally:
+            evaluator.close()
+            population.close()
+
+        print("[b] population {:>7} - pickle {:.3f}s ({:.1f}MB sent) - shared memory {:.3f}s ({} ranges sent) - x{:.1f}".format(
+            size, t_pickle, transferred / 2 ** 20, t_shm, len(ranges), t_pickle / t_shm))
+
+
+if __name__ == "__main__":
+    # python BeeShm.py [max population size]
+    maxSize = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    benchmark(tuple(size for size in (1000, 10000, 100000) if size <= maxSize))
@@ -0,0 +1,283 @@
+###############################################################################
+## Stigmee: A 3D browser and decentralized social network.
+## Copyright 2021 Duron Alain <duron.alain@gmail.com>
+##
+## This file is part of Stigmee.
+##
+## Project : Stigmee BeeBot
+## Version : 0.0-1
+## Date : 20-11-2021
+## Author : Alain Duron
+## File : BeeStigmer.py
+##
+## Stigmee is free software: you can redistribute it and/or modify it
+## under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+# TODO:
+#   Reward the useful curating work of stigmers
+#   Persist votes through BeeAsyncDB
+
+import asyncio
+import random
+import timeit
+from collections import OrderedDict
+from BeeVolve import *
+from BeePreference import PreferenceModel
+
+"""
+StigmerService is the production (user curation) loop of BeeVolve : fitness comes from user
+decisions instead of the test inversion metric.
+
+User decisions are aggregated in an incremental PreferenceModel (see BeePreference) which gives
+the strand fitness.
+
+1. requestStrand() picks two strands of the population (stigmerSelection), mixes the urls they
+   show and hands them to a user as a ticket.
+2. submitVote() buffers the user's accepted / rejected urls, it never waits for the population.
+3. A background task applies the buffered votes in batched micro-generations : votes first update
+   the user fitness, the population is re-scored once, then each vote produces a child
+   (stigmerCrossover + mutation) that replaces the weaker of its two parents.
+
+Many concurrent users are therefore served by one population without a blocking evaluation per child.
+"""
+class StigmerService:
+
+    def __init__(self, _volve, _showSize=10, _batchSize=64, _maxDelay=0.05, _maxTickets=100000, _model=None):
+        """
+        :param _volve: the BeeVolve instance to curate, its fitness function is replaced by the user one
+        :param _showSize: number of top urls of each parent shown to the user
+        :param _batchSize: maximum number of votes applied in one micro-generation
+        :param _maxDelay: maximum time (s) a vote waits in the buffer before being applied
+        :param _maxTickets: number of unanswered tickets kept, the oldest ones expire first
+        :param _model: PreferenceModel to start from (eg. a snapshot), a fresh one by default
+        """
+        self.volve = _volve
+        self.showSize = min(_showSize, _volve.strandSize)
+        self.batchSize = _batchSize
+        self.maxDelay = _maxDelay
+        self.maxTickets = _maxTickets
+
+        self.tickets = OrderedDict()    # ticket id -> ((slotA, slotB, strandA, strandB), shown url ids)
+        self.nextTicket = 0
+        self.votes = asyncio.Queue(maxsize=_batchSize * 16)  # Bounded : voters wait if generations lag behind
+        self.batch = []                 # votes taken off the queue, not applied yet
+        self.task = None
+        self.listeners = []             # callables notified after each micro-generation
+
+        # User preferences per url id
+        self.model = _model if _model is not None else PreferenceModel(max(_volve.data.keys()) + 1,
+                                                                        _volve.strandSize)
+        self.model.setStrandSize(_volve.strandSize)
+        self.model.grow(max(_volve.data.keys()) + 1)
+
+        # statistics
+        self.votesReceived = 0
+        self.votesApplied = 0
+        self.ticketsExpired = 0
+
+        # From now on the population is evaluated by users, strands bred before included
+        self.volve.fitnessFn = self.model.strandFitness
+        self.volve.metric = "USR"
+        for strands in (self.volve.population, self.volve.matingPool):
+            for strand in strands:
+                strand.fitnessFn = self.model.strandFitness
+        self.volve.matingPool = self.volve.population
+        self.rescore()
+
+    def rescore(self):
+        """
+        User fitness moves with every vote, strands are re-scored once per micro-generation
+        """
+        population = self.volve.population
+        for strand in population:
+            strand.computeStrandFitness()
+        best = min(population, key=lambda s: s.getStrandFitness())
+        self.volve.best = best.copy()
+
+    def requestStrand(self, _userId=None):
+        """
+        returns (ticket id, urls) : the top urls of two strands, mixed up so that the user
+        is not influenced by the order they come from
+        """
+        slotA, slotB = self.volve.stigmerSelection()
+        sA = self.volve.population[slotA]
+        sB = self.volve.population[slotB]
+        shown = list(dict.fromkeys(sA.strandGenes[:self.showSize] + sB.strandGenes[:self.showSize]))
+        random.shuffle(shown)
+
+        ticket = self.nextTicket
+        self.nextTicket += 1
+        self.tickets[ticket] = ((slotA, slotB, sA, sB), shown)
+        if len(self.tickets) > self.maxTickets:
+            self.tickets.popitem(last=False)
+            self.ticketsExpired += 1
+        return ticket, [(gene, self.volve.data[gene]) for gene in shown]
+
+    async def submitVote(self, _ticket, _accepted, _rejected):
+        """
+        Buffer a user decision (url ids accepted / rejected among the ones shown)
+        returns False if the ticket is unknown or expired
+        """
+        ticket = self.tickets.pop(_ticket, None)
+        if ticket is None:
+            return False
+        parents, shown = ticket
+        self.votesReceived += 1
+        await self.votes.put((parents, shown, _accepted, _rejected))
+        return True
+
+    async def start(self):
+
+        if self.task is None:
+            self.task = asyncio.create_task(self.applyLoop())
+
+    async def stop(self, _drain=True):
+        """
+        Stop applying votes, the pending ones are applied first if _drain is set
+        """
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        # The batch being filled when the task was cancelled
+        batch, self.batch = self.batch, []
+        if _drain and batch:
+            self.applyBatch(batch)
+        while _drain and not self.votes.empty():
+            batch = []
+            while len(batch) < self.batchSize and not self.votes.empty():
+                batch.append(self.votes.get_nowait())
+            self.applyBatch(batch)
+
+    async def applyLoop(self):
+
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = self.batch = [await self.votes.get()]
+            deadline = loop.time() + self.maxDelay
+            while len(batch) < self.batchSize:
+                while len(batch) < self.batchSize and not self.votes.empty():
+                    batch.append(self.votes.get_nowait())
+                remaining = deadline - loop.time()
+                if len(batch) >= self.batchSize or remaining <= 0:
+                    break
+                # Let the voters run until the batch is full or the delay is over
+                await asyncio.sleep(min(remaining, self.maxDelay / 4))
+            self.batch = []
+            self.applyBatch(batch)
+            # Applying a batch is CPU bound, give the voters their turn
+            await asyncio.sleep(0)
+
+    def applyBatch(self, batch):
+        """
+        One micro-generation out of a batch of votes
+        """
+        volve = self.volve
+        population = volve.population
+        s1 = timeit.default_timer()
+
+        # 1. votes update the user fitness, the population is re-scored once for the whole batch
+        for _, shown, accepted, rejected in batch:
+            self.model.recordDecision(accepted, rejected, shown)
+        self.rescore()
+
+        s2 = timeit.default_timer()
+        t_mutn = 0
+        for (slotA, slotB, sA, sB), _, accepted, rejected in batch:
+            # 2. crossover guided by the user decision
+            child = volve.stigmerCrossover(sA, sB, accepted, rejected)
+            m1 = timeit.default_timer()
+            before = child.getStrandFitness()
+            if volve.mutate(child) and volve.adapt is not None:
+                volve.adapt.recordMutation(before, child)
+            t_mutn += timeit.default_timer() - m1
+
+            # 3. the child replaces the weaker parent (still in place, or its replacement)
+            loser = slotA if population[slotA].getStrandFitness() >= population[slotB].getStrandFitness() else slotB
+            if not volve.bestonly or child.getStrandFitness() < population[loser].getStrandFitness():
+                population[loser] = child
+
+        s3 = timeit.default_timer()
+        self.votesApplied += len(batch)
+        volve.iteration += 1
+        if volve.adapt is not None:
+            volve.adapt.endGeneration()
+        volve.stat_board.append([s2 - s1, s3 - s2 - t_mutn, t_mutn, volve.best.getStrandFitness(),
+                                 volve.poolFitness(), volve.best.strandGenes])
+        if volve.metrics is not None:
+            volve.metrics.generation(volve, timeit.default_timer() - s1, _children=len(batch))
+        for listener in self.listeners:
+            listener(self)
+
+
+def inversionFitness(volve, genes):
+    """
+    Offline (test mode) fitness of genes : the original index is the ground truth
+    """
+    return Strand(volve.strandSize, volve.data, list(genes)).getStrandFitness()
+
+
+async def simulateUsers(_service, _users=100, _votes=10000, _noise=0.1, _tolerance=0.3, _thinkTime=0.0):
+    """
+    Load test driver : _users simulated users request strands and vote concurrently until _votes votes
+    are cast. A simulated user accepts the third of the shown urls it finds the most relevant and rejects
+    the least relevant third, relevance being the original index blurred by _noise.
+    Convergence is reached when the best strand is within _tolerance of the optimal inversion fitness.
+    returns a dictionary of statistics (votes/sec, time and votes to convergence...)
+    """
+    volve = _service.volve
+    optimum = inversionFitness(volve, sorted(volve.data.keys()))
+    blur = _noise * len(volve.data)
+    stats = {"votes": 0, "converged_time": None, "converged_votes": None, "converged_generation": None}
+    votesPerUser = [0] * _users
+    begin = timeit.default_timer()
+
+    def monitor(service):
+        if stats["converged_time"] is None:
+            if inversionFitness(volve, volve.best.strandGenes) <= optimum * (1 + _tolerance):
+                stats["converged_time"] = timeit.default_timer() - begin
+                stats["converged_votes"] = service.votesApplied
+                stats["converged_generation"] = volve.iteration
+
+    async def user(userId):
+        while stats["votes"] < _votes:
+            stats["votes"] += 1
+            ticket, urls = _service.requestStrand(userId)
+            ranked = sorted((gene for gene, _ in urls), key=lambda gene: gene + random.gauss(0, blur))
+            third = max(1, len(ranked) // 3)
+            if _thinkTime:
+                await asyncio.sleep(random.expovariate(1.0 / _thinkTime))
+            await _service.submitVote(ticket, ranked[:third], ranked[-third:])
+            votesPerUser[userId] += 1
+            # submitVote only waits when the vote buffer is full : let the other users vote too
+            await asyncio.sleep(0)
+
+    _service.listeners.append(monitor)
+    await _service.start()
+    await asyncio.gather(*(user(u) for u in range(_users)))
+    await _service.stop()
+    _service.listeners.remove(monitor)
+
+    elapsed = timeit.default_timer() - begin
+    voters = sum(1 for count in votesPerUser if count)
+    if voters < min(_users, _votes) // 2:
+        raise RuntimeError("only {} of {} simulated users voted".format(voters, _users))
+    stats.update({"users": _users, "voters": voters, "max_user_votes": max(votesPerUser), "elapsed": elapsed, "votes_per_sec": _service.votesApplied / elapsed,
+                  "generations": volve.iteration, "optimum": optimum,
+                  "best_inversion": inversionFitness(volve, volve.best.strandGenes)})
+    return stats
@@ -0,0 +1,353 @@
+###############################################################################
+## Stigmee: A 3D browser and decentralized social network.
+## Copyright 2021 Duron Alain <duron.alain@gmail.com>
+##
+## This file is part of Stigmee.
+##
+## Project : Stigmee BeeBot
+## Version : 0.0-1
+## Date : 20-11-2021
+## Author : Alain Duron
+## File : BeeStore.py
+##
+## Stigmee is free software: you can redistribute it and/or modify it
+## under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+# TODO:
+#   Store strand metadata (tags, pertivirality score...) once Strand handles them
+
+import time
+from array import array
+from itertools import islice
+from collections import OrderedDict
+from BeeStrand import *
+
+"""
+BeeStore is the persistence layer of BeeVolve on top of BeeDB. It keeps, per query :
+ - the url collection the strands are built from
+ - the strands of the population ('P') and of the mating pool ('M'), genes packed as int32 blobs
+ - the history of the best strand found at each generation
+
+Statements stick to SQL understood by both MariaDB and SQLite (REPLACE INTO, qmark parameters)
+so the store runs on the production database as well as on the local SQLite stand-in.
+"""
+
+POPULATION = "P"
+MATINGPOOL = "M"
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS bee_queries ("
+    "  id INTEGER NOT NULL PRIMARY KEY,"
+    "  query VARCHAR(255) NOT NULL,"
+    "  created DOUBLE NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS bee_queries_query ON bee_queries (query)",
+    "CREATE TABLE IF NOT EXISTS bee_urls ("
+    "  query_id INTEGER NOT NULL,"
+    "  url_id INTEGER NOT NULL,"
+    "  url TEXT NOT NULL,"
+    "  PRIMARY KEY (query_id, url_id))",
+    "CREATE TABLE IF NOT EXISTS bee_strands ("
+    "  query_id INTEGER NOT NULL,"
+    "  pool CHAR(1) NOT NULL,"
+    "  slot INTEGER NOT NULL,"
+    "  genes BLOB NOT NULL,"
+    "  fitness DOUBLE NOT NULL,"
+    "  PRIMARY KEY (query_id, pool, slot))",
+    "CREATE INDEX IF NOT EXISTS bee_strands_fitness ON bee_strands (query_id, pool, fitness)",
+    "CREATE TABLE IF NOT EXISTS bee_best ("
+    "  query_id INTEGER NOT NULL,"
+    "  generation INTEGER NOT NULL,"
+    "  genes BLOB NOT NULL,"
+    "  fitness DOUBLE NOT NULL,"
+    "  PRIMARY KEY (query_id, generation))",
+)
+
+
+def packGenes(genes):
+    """
+    Strand genes (url ids) as a compact int32 blob
+    """
+    return array('i', genes).tobytes()
+
+
+def unpackGenes(blob):
+
+    genes = array('i')
+    genes.frombytes(bytes(blob))
+    return genes.tolist()
+
+
+class BeeStore:
+
+    def __init__(self, _db):
+        """
+        :param _db: a connected BeeDB instance (or one borrowed from a BeeDBPool)
+        """
+        self.db = _db
+        self.createSchema()
+
+    def createSchema(self):
+
+        for stmt in SCHEMA:
+            self.db.execute_stmt(stmt)
+        self.db.commit()
+
+    def getQueryId(self, _query, _create=True):
+        """
+        returns the id of a query (search keywords or input file), registering it if needed
+        """
+        row = self.db.execute_query("SELECT id FROM bee_queries WHERE query = ?", (_query,)).fetchone()
+        if row is not None:
+            return row[0]
+        if not _create:
+            return None
+        # No AUTO_INCREMENT / AUTOINCREMENT, their syntax differ between MariaDB and SQLite
+        row = self.db.execute_query("SELECT COALESCE(MAX(id), 0) + 1 FROM bee_queries").fetchone()
+        self.db.execute_stmt("INSERT INTO bee_queries (id, query, created) VALUES (?, ?, ?)",
+                             (row[0], _query, time.time()), _commit=True)
+        return row[0]
+
+    def saveUrls(self, _queryId, _data):
+        """
+        Store the {url_id: url} collection of a query, replacing the previous one
+        """
+        self.db.execute_stmt("DELETE FROM bee_urls WHERE query_id = ?", (_queryId,))
+        self.db.insert_rows("bee_urls", ("query_id", "url_id", "url"),
+                            ((_queryId, id, url) for id, url in _data.items()), _commit=True)
+
+    def importUrlFile(self, _queryId, _inputFile, _chunkSize=1000):
+        """
+        Store the urls of an "<id> <url>" file, streaming it so that a corpus of millions
+        of urls never has to fit in memory. returns the number of urls imported
+        """
+        def rows(file):
+            for line in file:
+                if line.strip():
+                    (id, url) = line.split()
+                    yield (_queryId, int(id), url)
+
+        self.db.execute_stmt("DELETE FROM bee_urls WHERE query_id = ?", (_queryId,))
+        with open(_inputFile) as file:
+            return self.db.insert_rows("bee_urls", ("query_id", "url_id", "url"), rows(file),
+                                       _chunkSize=_chunkSize, _commit=True)
+
+    def iterUrls(self, _queryId, _chunkSize=1000):
+        """
+        Stream the (url_id, url) pairs of a query, ordered by url id
+        """
+        return self.db.stream_query("SELECT url_id, url FROM bee_urls WHERE query_id = ? ORDER BY url_id",
+                                    (_queryId,), _chunkSize)
+
+    def loadUrls(self, _queryId, _limit=None):
+        """
+        returns the {url_id: url} collection of a query (its first _limit urls), ordered by url id
+        """
+        urls = self.iterUrls(_queryId)
+        try:
+            return dict(islice(urls, _limit))
+        finally:
+            urls.close()
+
+    def strandRow(self, _queryId, _pool, _slot, _strand):
+
+        return (_queryId, _pool, _slot, packGenes(_strand.strandGenes), _strand.getStrandFitness())
+
+    def saveStrands(self, _queryId, _pool, _strands, _commit=True):
+        """
+        Store (slot, strand) pairs of a pool in bulk
+        """
+        self.db.executemany("REPLACE INTO bee_strands (query_id, pool, slot, genes, fitness) VALUES (?, ?, ?, ?, ?)",
+                            (self.strandRow(_queryId, _pool, slot, strand) for slot, strand in _strands),
+                            _commit=_commit)
+
+    def makeStrand(self, _data, _strandSize, _genes, _fitness):
+
+        return Strand(_strandSize, _data, unpackGenes(_genes), _fitness=_fitness)
+
+    def loadStrands(self, _queryId, _pool, _slots, _data, _strandSize):
+        """
+        Load only the given slots of a pool, returns a {slot: Strand} dictionary
+        """
+        strands = {}
+        slots = list(_slots)
+        chunkSize = self.db.MAX_PARAMS - 2
+        for i in range(0, len(slots), chunkSize):
+            chunk = slots[i:i + chunkSize]
+            query = "SELECT slot, genes, fitness FROM bee_strands WHERE query_id = ? AND pool = ? AND slot IN ({})".format(
+                ", ".join("?" for _ in chunk))
+            for slot, genes, fitness in self.db.execute_query(query, (_queryId, _pool, *chunk)).fetchall():
+                strands[slot] = self.makeStrand(_data, _strandSize, genes, fitness)
+        return strands
+
+    def poolSize(self, _queryId, _pool):
+
+        return self.db.execute_query("SELECT COUNT(*) FROM bee_strands WHERE query_id = ? AND pool = ?",
+                                     (_queryId, _pool)).fetchone()[0]
+
+    def copyPool(self, _queryId, _src, _dst):
+        """
+        Replace pool _dst with a copy of pool _src, entirely on the database side
+        """
+        self.db.execute_stmt("DELETE FROM bee_strands WHERE query_id = ? AND pool = ?", (_queryId, _dst))
+        self.db.execute_stmt("INSERT INTO bee_strands (query_id, pool, slot, genes, fitness) "
+                             "SELECT query_id, ?, slot, genes, fitness FROM bee_strands WHERE query_id = ? AND pool = ?",
+                             (_dst, _queryId, _src), _commit=True)
+
+    def bestFitness(self, _queryId, _pool):
+
+        return self.db.execute_query("SELECT MIN(fitness) FROM bee_strands WHERE query_id = ? AND pool = ?",
+                                     (_queryId, _pool)).fetchone()[0]
+
+    def bestStrands(self, _queryId, _pool, _data, _strandSize, _count=1):
+        """
+        returns the _count fittest strands of a pool (uses the fitness index)
+        """
+        rows = self.db.execute_query("SELECT genes, fitness FROM bee_strands WHERE query_id = ? AND pool = ? "
+                                     "ORDER BY fitness LIMIT {}".format(int(_count)), (_queryId, _pool)).fetchall()
+        return [self.makeStrand(_data, _strandSize, genes, fitness) for genes, fitness in rows]
+
+    def saveBest(self, _queryId, _generation, _strand):
+
+        self.db.execute_stmt("REPLACE INTO bee_best (query_id, generation, genes, fitness) VALUES (?, ?, ?, ?)",
+                             (_queryId, _generation, packGenes(_strand.strandGenes), _strand.getStrandFitness()),
+                             _commit=True)
+
+    def nextGeneration(self, _queryId):
+        """
+        returns the generation number following the best history of a query (0 if it has none),
+        so that a resumed run extends the history instead of overwriting it
+        """
+        row = self.db.execute_query("SELECT MAX(generation) FROM bee_best WHERE query_id = ?", (_queryId,)).fetchone()
+        return 0 if row is None or row[0] is None else row[0] + 1
+
+    def bestHistory(self, _queryId):
+        """
+        returns [(generation, fitness, genes)] for a query, oldest first
+        """
+        rows = self.db.execute_query("SELECT generation, fitness, genes FROM bee_best WHERE query_id = ? "
+                                     "ORDER BY generation", (_queryId,)).fetchall()
+        return [(generation, fitness, unpackGenes(genes)) for generation, fitness, genes in rows]
+
+
+"""
+LazyPopulation is a list-like view over a pool of strands stored in BeeStore.
+Only the strands a generation actually touches are loaded, and at most _cacheSize of them
+are kept in memory (LRU). Replaced strands are written back when evicted or on flush(),
+so a population bigger than the available memory can evolve from the database.
+"""
+class LazyPopulation:
+
+    def __init__(self, _store, _queryId, _pool, _data, _strandSize, _cacheSize=4096):
+
+        self.store = _store
+        self.queryId = _queryId
+        self.pool = _pool
+        self.data = _data
+        self.strandSize = _strandSize
+        self.cacheSize = _cacheSize
+        self.cache = OrderedDict()  # slot -> Strand, most recently used last
+        self.dirty = {}             # slot -> Strand not written yet
+        self.size = self.store.poolSize(self.queryId, self.pool)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self[i]
+
+    def __getitem__(self, slot):
+
+        if slot < 0:
+            slot += self.size
+        if slot < 0 or slot >= self.size:
+            raise IndexError("strand slot out of range")
+        strand = self.cache.get(slot)
+        if strand is not None:
+            self.hits += 1
+            self.cache.move_to_end(slot)
+            return strand
+        self.misses += 1
+        strand = self.store.loadStrands(self.queryId, self.pool, (slot,), self.data, self.strandSize)[slot]
+        self.cacheStrand(slot, strand)
+        return strand
+
+    def __setitem__(self, slot, strand):
+
+        if slot < 0:
+            slot += self.size
+        if slot < 0 or slot >= self.size:
+            raise IndexError("strand slot out of range")
+        self.dirty[slot] = strand
+        self.cacheStrand(slot, strand)
+
+    def append(self, strand):
+
+        self.size += 1
+        self[self.size - 1] = strand
+
+    def cacheStrand(self, slot, strand):
+
+        self.cache[slot] = strand
+        self.cache.move_to_end(slot)
+        if len(self.cache) > self.cacheSize:
+            evicted = []
+            while len(self.cache) > self.cacheSize:
+                old, _ = self.cache.popitem(last=False)
+                if old in self.dirty:
+                    evicted.append((old, self.dirty.pop(old)))
+            if evicted:
+                self.store.saveStrands(self.queryId, self.pool, evicted)
+
+    def prefetch(self, _slots):
+        """
+        Load a set of slots with a single query (eg. the parents selected for a generation)
+        """
+        missing = [slot for slot in set(_slots) if slot not in self.cache]
+        if missing:
+            self.misses += len(missing)
+            for slot, strand in self.store.loadStrands(self.queryId, self.pool, missing, self.data,
+                                                       self.strandSize).items():
+                self.cacheStrand(slot, strand)
+
+    def flush(self):
+        """
+        Write back every replaced strand
+        """
+        if self.dirty:
+            self.store.saveStrands(self.queryId, self.pool, self.dirty.items())
+            self.dirty = {}
+
+    def assignFrom(self, other):
+        """
+        Make this pool a copy of another one (pool = population), database side
+        """
+        other.flush()
+        self.dirty = {}
+        self.cache.clear()
+        self.store.copyPool(self.queryId, other.pool, self.pool)
+        self.size = other.size
+
+    def bestFitness(self):
+
+        self.flush()
+        return self.store.bestFitness(self.queryId, self.pool)
+
+    def bestStrand(self):
+
+        self.flush()
+        best = self.store.bestStrands(self.queryId, self.pool, self.data, self.strandSize, 1)
+        return best[0] if best else None
@@ -26,22 +26,63 @@
 
 # TODO:
 #   Add the required structures to handle additional metadata within a Strand
-#   Add a stigmergic evaluation function
 
 import random
+from collections import OrderedDict
+
+
+class FitnessCache:
+    """
+    Bounded (LRU) cache of test fitness values, keyed by strand genes. The inversion fitness
+    only depends on the genes, so the cache can be shared by every population of the process
+    (see BeeSession). Installed with Strand.fitnessCache = FitnessCache(...), BeeSession.SessionManager
+    only installs its own while it runs its sessions
+    """
+
+    def __init__(self, _maxSize=1 << 20):
+
+        self.maxSize = _maxSize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+
+        fitness = self.entries.get(key)
+        if fitness is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return fitness
+
+    def put(self, key, fitness):
+
+        self.entries[key] = fitness
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
 
 class Strand:
 
-    def __init__(self, _strandSize, _origGenes, _childGenes, _nni=False):
+    # Process wide FitnessCache for the test fitness, None to always compute it
+    fitnessCache = None
+
+    def __init__(self, _strandSize, _origGenes, _childGenes, _nni=False, _fitnessFn=None, _fitness=None):
         """
         Genetic setup of a strand
         To be used during testing. Fitness evaluation is based on the best ascending order
         compared to the original indexing. A way to measure the fitness is by inversion measurement
         https://en.wikipedia.org/wiki/Inversion_(discrete_mathematics)
+
+        In stigmergic mode, _fitnessFn(strandGenes) gives the fitness from user decisions instead
+        (still a minimization)
+        _fitness is the fitness of the genes when it is already known (eg. a copy), it is not computed again
         """
         self.strandFitness = 0
         self.strandGenes = []
         self.strandSize = _strandSize
+        self.fitnessFn = _fitnessFn
         # Orig genes is a given dictionary of (key, values) tuples which can be used for initialization
         self.origGenes = _origGenes
 
@@ -55,19 +96,22 @@ class Strand:
                 random.shuffle(self.strandGenes)
             else:
                 # If we want NNI we keep the incoming indexing and just chose a random starting point
-                i = random.randint(0,self.strandSize-1)
-                self.strandGenes[i:self.strandSize-1] = _origGenes.keys()[i:_origGenes-1]
-                self.strandGenes[0:i-1] = _origGenes.keys()[0:i-1]
+                # (a rotation of the original ranking)
+                genes = list(_origGenes.keys())
+                i = random.randrange(len(genes))
+                self.strandGenes = genes[i:] + genes[:i]
         # Compute the fitness of a strand
-        self.computeStrandFitness()
+        if _fitness is None:
+            self.computeStrandFitness()
+        else:
+            self.strandFitness = _fitness
 
     def copy(self):
         """
         duplicating a strand (in case we intend to copy the same one for partial population replacement)
         """
-        s = Strand(self.strandSize, self.origGenes, self.strandGenes[0:self.strandSize])
-        s.strandFitness = self.getStrandFitness()
-        return s
+        return Strand(self.strandSize, self.origGenes, self.strandGenes[0:self.strandSize], _fitnessFn=self.fitnessFn,
+                      _fitness=self.getStrandFitness())
 
     def computeStrandFitness(self):
         """
@@ -76,8 +120,21 @@ class Strand:
         We compute the number of inversions for all possible pairs of indices and add the initial index value
 
         For testing purpose, if we want to evaluate a strand originally indexes,
-        we try to minimize this value. This computation does not apply to user curation of strands
+        we try to minimize this value. This computation does not apply to user curation of strands,
+        where the fitness function given at creation is used instead
         """
+        if self.fitnessFn is not None:
+            self.strandFitness = self.fitnessFn(self.strandGenes)
+            return
+
+        cache = Strand.fitnessCache
+        if cache is not None:
+            key = tuple(self.strandGenes[0:self.strandSize])
+            fitness = cache.get(key)
+            if fitness is not None:
+                self.strandFitness = fitness
+                return
+
         distances = 0
         for i in range(0, self.strandSize - 1):
             # Add the distance to 0 for each gene
@@ -87,6 +144,8 @@ class Strand:
                     # If a permutation is detected, we add the corresponding index distance
                     distances += self.strandGenes[i] - self.strandGenes[j]
         self.strandFitness = distances
+        if cache is not None:
+            cache.put(key, distances)
 
 
     def getStrandFitness(self):
@@ -0,0 +1,257 @@
+###############################################################################
+## Stigmee: A 3D browser and decentralized social network.
+## Copyright 2021 Duron Alain <duron.alain@gmail.com>
+##
+## This file is part of Stigmee.
+##
+## Project : Stigmee BeeBot
+## Version : 0.0-1
+## Date : 20-11-2021
+## Author : Alain Duron
+## File : BeeSurrogate.py
+##
+## Stigmee is free software: you can redistribute it and/or modify it
+## under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+# TODO:
+#   Plug the surrogate in front of StigmerService so that only routed strands reach users
+
+import math
+import random
+import timeit
+from BeeVolve import *
+
+"""
+In user curation mode every child needs a human judgement, by far the scarcest resource.
+The surrogate-assisted mode breeds more candidates than it can afford to evaluate, pre-scores them
+with a cheap model trained on the evaluations collected so far, and only routes to real evaluation
+the most promising candidates (lowest predicted fitness) and the most uncertain ones (where the
+model learns the most). The others are discarded without costing anything.
+"""
+
+
+class SurrogateModel:
+    """
+    Bootstrap ensemble of online linear models : predicted fitness = bias + sum(theta[url] * position(url)).
+    Each member sees every observation a Poisson(1) number of times, the spread of their predictions
+    is the uncertainty of the estimate. Training and prediction are O(members * strandSize).
+    """
+
+    def __init__(self, _strandSize, _members=5, _learningRate=0.5):
+
+        self.strandSize = _strandSize
+        self.members = _members
+        self.learningRate = _learningRate
+        self.biases = [0.0] * _members
+        self.thetas = [{} for _ in range(_members)]
+        # Running mean / variance of the observed fitness, the members learn the normalized value
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def features(self, genes):
+
+        scale = 1.0 / max(1, self.strandSize - 1)
+        return [(gene, pos * scale) for pos, gene in enumerate(genes)]
+
+    def scale(self):
+
+        return math.sqrt(self.m2 / self.count) if self.count > 1 and self.m2 > 0 else 1.0
+
+    def observe(self, genes, fitness):
+        """
+        Train on one real evaluation
+        """
+        self.count += 1
+        delta = fitness - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (fitness - self.mean)
+
+        target = (fitness - self.mean) / self.scale()
+        features = self.features(genes)
+        norm = 1.0 + sum(x * x for _, x in features)
+        for m in range(self.members):
+            theta = self.thetas[m]
+            for _ in range(self.poisson()):
+                error = target - self.biases[m] - sum(theta.get(gene, 0.0) * x for gene, x in features)
+                # Normalized least mean squares step
+                step = self.learningRate * error / norm
+                self.biases[m] += step
+                for gene, x in features:
+                    theta[gene] = theta.get(gene, 0.0) + step * x
+
+    @staticmethod
+    def poisson():
+
+        # Knuth's method, lambda = 1
+        limit = math.exp(-1.0)
+        k, p = 0, random.random()
+        while p > limit:
+            k += 1
+            p *= random.random()
+        return k
+
+    def predict(self, genes):
+        """
+        returns (mean, standard deviation) of the predicted fitness
+        """
+        features = self.features(genes)
+        predictions = [self.biases[m] + sum(self.thetas[m].get(gene, 0.0) * x for gene, x in features)
+                       for m in range(self.members)]
+        mean = sum(predictions) / self.members
+        var = sum((p - mean) ** 2 for p in predictions) / self.members
+        scale = self.scale()
+        return self.mean + mean * scale, math.sqrt(var) * scale
+
+    def predictFitness(self, genes):
+
+        return self.predict(genes)[0]
+
+
+"""
+SurrogateVolve drives a BeeVolve instance in surrogate-assisted mode and counts real evaluations.
+"""
+class SurrogateVolve:
+
+    def __init__(self, _volve, _model=None, _candidates=2.0, _evalFraction=0.25, _exploreFraction=0.25,
+                 _randomScreening=False):
+        """
+        :param _volve: the BeeVolve instance (its initial population has been evaluated already)
+        :param _model: the SurrogateModel, a new one by default
+        :param _candidates: number of candidates bred per generation, as a multiple of the population size
+        :param _evalFraction: number of candidates routed to real evaluation, as a fraction of the population size
+        :param _exploreFraction: part of the routed candidates picked for their uncertainty rather than their score
+        :param _randomScreening: route random candidates instead of the surrogate picks (baseline)
+        """
+        self.volve = _volve
+        self.model = _model if _model is not None else SurrogateModel(_volve.strandSize)
+        self.candidates = max(1, int(_volve.popSize * _candidates))
+        self.routed = max(1, int(_volve.popSize * _evalFraction))
+        self.explore = int(self.routed * _exploreFraction)
+        self.realFitnessFn = _volve.fitnessFn
+        self.randomScreening = _randomScreening
+
+        # The initial population was evaluated for real
+        self.evaluations = len(_volve.population)
+        for strand in _volve.population:
+            self.model.observe(strand.strandGenes, strand.getStrandFitness())
+
+    def breed(self):
+        """
+        Selection / crossover / mutation as in newGeneration, children scored by the surrogate only
+        """
+        volve = self.volve
+        volve.fitnessFn = self.model.predictFitness
+        volve.provisional = True
+        try:
+            children = []
+            for _ in range(self.candidates):
+                parent1, parent2 = volve.selectParents()
+                child = volve.similarityBasedCrossover(parent1, parent2)
+                volve.mutate(child)
+                children.append(child)
+        finally:
+            volve.fitnessFn = self.realFitnessFn
+            volve.provisional = False
+        return children
+
+    def step(self):
+        """
+        One surrogate-assisted generation : breed, pre-score, route the selected candidates to real
+        evaluation, and let them replace the worst strands of the population they beat
+        """
+        volve = self.volve
+        begin = timeit.default_timer()
+        volve.updateMatingPool()
+        children = self.breed()
+
+        if self.randomScreening:
+            routed = random.sample(children, min(self.routed, len(children)))
+        else:
+            scored = [(self.model.predict(child.strandGenes), child) for child in children]
+            scored.sort(key=lambda item: item[0][0])
+            exploit = scored[:self.routed - self.explore]
+            rest = sorted(scored[self.routed - self.explore:], key=lambda item: -item[0][1])
+            routed = [child for _, child in exploit + rest[:self.explore]]
+
+        for child in routed:
+            child.fitnessFn = self.realFitnessFn
+            child.computeStrandFitness()
+            self.evaluations += 1
+            self.model.observe(child.strandGenes, child.getStrandFitness())
+            volve.updateBest(child)
+
+        population = volve.population
+        worst = sorted(range(len(population)), key=lambda i: -population[i].getStrandFitness())
+        for child, slot in zip(sorted(routed, key=lambda s: s.getStrandFitness()), worst):
+            if child.getStrandFitness() < population[slot].getStrandFitness():
+                population[slot] = child
+                # Steady-state mode : keep the fitness index in step with the population
+                if volve.fitnessIndex is not None:
+                    volve.fitnessIndex.update(slot, child.getStrandFitness())
+
+        volve.stat_board.append([0, 0, 0, volve.best.getStrandFitness(), volve.poolFitness(),
+                                 volve.best.strandGenes])
+        volve.iteration += 1
+        if volve.metrics is not None:
+            volve.metrics.generation(volve, timeit.default_timer() - begin, _children=len(children))
+
+
+def compareEvaluations(_inputFile, _psize, _mutRate, _target, _maxIter=500, _strandSize=21, _apct=20,
+                       _candidates=2.0, _evalFraction=0.25, _seed=None):
+    """
+    Count the real evaluations needed to reach _target (offline inversion fitness as ground truth)
+    by the plain GA loop, where every child produced needs one, and by the surrogate-assisted loop.
+    The saving is reported against the same elitist replace-worst loop routing random candidates,
+    so that it measures the surrogate screening alone (the saving against the plain loop also
+    includes the effect of the replacement scheme).
+    """
+    def volve():
+        return BeeVolve(_inputFile, _psize, _mutRate, _maxIter, "RGS", "SIM", "BIN", "SCR", _strandSize, _apct)
+
+    report = {"target": _target}
+
+    random.seed(_seed)
+    plain = volve()
+    evaluations = plain.popSize
+    while plain.best.getStrandFitness() > _target and plain.iteration < _maxIter:
+        plain.GeneticStigmergicStep()
+        plain.iteration += 1
+        evaluations += plain.popSize
+    report.update({"plain_evaluations": evaluations, "plain_generations": plain.iteration,
+                   "plain_best": plain.best.getStrandFitness()})
+
+    for name, randomScreening in (("random", True), ("surrogate", False)):
+        random.seed(_seed)
+        assisted = SurrogateVolve(volve(), _candidates=_candidates, _evalFraction=_evalFraction,
+                                  _randomScreening=randomScreening)
+        while assisted.volve.best.getStrandFitness() > _target and assisted.volve.iteration < _maxIter:
+            assisted.step()
+        report.update({name + "_evaluations": assisted.evaluations, name + "_generations": assisted.volve.iteration,
+                       name + "_best": assisted.volve.best.getStrandFitness()})
+
+    report["saved_evaluations"] = report["random_evaluations"] - report["surrogate_evaluations"]
+    report["saved_pct"] = 100.0 * report["saved_evaluations"] / report["random_evaluations"]
+    report["saved_vs_plain_pct"] = 100.0 * (report["plain_evaluations"] - report["surrogate_evaluations"]) \
+        / report["plain_evaluations"]
+    return report
+
+
+if __name__ == "__main__":
+    # python BeeSurrogate.py [file] [psize] [target]
+    inputFile = sys.argv[1] if len(sys.argv) > 1 else "test_urls.txt"
+    psize = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    target = float(sys.argv[3]) if len(sys.argv) > 3 else 220
+    for seed in range(3):
+        print(compareEvaluations(inputFile, psize, 0.05, target, _seed=seed))
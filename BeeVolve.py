@@ -28,7 +28,6 @@
 #   Add the required structures to handle additional metadata within a Strand
 #     (tags, pertivirality score, creator's hash adress...)
 #   Add documentation to the header of each function
-#   Add methods (or better, a separate module ?) to handle the database calls
 #   Add separated execution modes : test (web scrapping) and run (using stigmergic functions)
 #   Decouple the strand size (number of urls shown to user) and the total evaluation size (all urls)
 
@@ -37,6 +36,11 @@ import sys
 import os
 import getopt
 from BeeStrand import *
+from BeeStore import *
+from BeeHeap import FitnessIndex
+from BeeInit import *
+from BeeFitness import FitnessMetric, METRICS, evaluateStrands
+from BeeAdapt import AdaptiveController
 import timeit
 import operator
 import matplotlib.pyplot as mpl
@@ -58,7 +62,9 @@ class BeeVolve:
     def __init__(self, _inputFile, _psize, _mutRate, _maxIter,
                  _initType, _xovrType, _slctType, _mutnType, _strandSize=21,
                  _apct=None, _xpct=None, _verbose=False, _bestOnly=False,
-                 _outfile=None, _chkptFile=None):
+                 _outfile=None, _chkptFile=None, _store=None, _query=None, _cacheSize=4096,
+                 _fitnessFn=None, _relational=None, _data=None, _steadyState=None, _warmDir=None,
+                 _metric=None, _adaptive=False, _metrics=None):
         """
         :param _inputFile:
         :param _psize:
@@ -75,6 +81,19 @@ class BeeVolve:
         :param _bestOnly:
         :param _outfile:
         :param _chkptFile:
+        :param _store: BeeStore to persist urls, population and best history in (None : in memory only)
+        :param _query: the query the population belongs to in the store (default : the input file)
+        :param _cacheSize: number of strands of each pool kept in memory when using a store
+        :param _fitnessFn: strand fitness from user decisions (stigmergic mode, metric USR), None for the test metric
+        :param _relational: BeeGraph.RelationalIndex holding friends preferences, used by the FRD selection
+        :param _data: {url id: url} collection to evolve (eg. search results) instead of reading _inputFile
+        :param _steadyState: number of children bred per step in steady-state mode (None : generational mode)
+        :param _warmDir: where the best strands of each query are saved at the end of a run, for WRM
+                         initialization (None : not saved, WRM reads BeeInit.WARM_DIR)
+        :param _metric: test fitness metric (see BeeFitness), None or INV for Strand's weighted inversions,
+                        USR when the population is to be curated by users (see BeeStigmer)
+        :param _adaptive: tune the mutation rate, section sizes and operators online (see BeeAdapt)
+        :param _metrics: BeeMetrics.VolveMetrics the progress of the run is reported to (None : no telemetry)
         """
 
         self.verbose = _verbose         # Wether messages should be displayed or not
@@ -97,29 +116,63 @@ class BeeVolve:
         self.maxIter = _maxIter  # Maximum number of iteration (Testing)
         self.iteration = 0
         self.data = {}
+        self.fitnessFn = _fitnessFn
+        self.metric = _metric if _metric is not None else ("INV" if _fitnessFn is None else "USR")
+        if self.fitnessFn is None and self.metric not in ("INV", "USR"):
+            self.fitnessFn = FitnessMetric(self.metric, self.strandSize)
+        self.provisional = False    # Children are scored by an estimate (surrogate), not candidates for best
+
+        # Persistence : with a store, the population and the mating pool live in the database
+        self.store = _store
+        self.query = _query if _query is not None else _inputFile
+        self.queryId = None
+        self.firstGeneration = 0        # Number of the first generation of this run in the best history
+        self.cacheSize = _cacheSize
 
         # Algorythm parameters
-        self.initType = _initType   # RGS (Randomly generated Strand) or NNI (Nearest Neighbour)
+        self.initType = _initType   # RGS (Randomly generated Strand), NNI (Nearest Neighbour), ROT (Rotation) or WRM (Warm start)
         self.xovrType = _xovrType   # SIM (Similarity-based uniform) or ORD (order-1)
-        self.slctType = _slctType   # RDM (Random) or BIN (Binary selection tournament)
-        self.mutnType = _mutnType   # SCR (Scramble) or INV (Inversion
+        self.slctType = _slctType   # RDM (Random), BIN (Binary selection tournament) or FRD (Relational)
+        self.mutnType = _mutnType   # SCR (Scramble) or INV (Inversion)
         self.apct = _apct           # The percentage of genes to consider when mutation occurs
         self.xpct = _xpct           # The section size to consider when crossover occurs
         # Allow replacement only when population individual is better than the one in the previous pool
         self.bestonly = _bestOnly
+        self.relational = _relational
+        self.preferred = {}         # genes -> scored Strand, for the strands friends preferred (FRD)
+        self.warmDir = _warmDir
+
+        # Steady-state mode : each step breeds a few children replacing the worst strands,
+        # the population is kept ordered by fitness in a FitnessIndex
+        self.steadyState = _steadyState
+        self.fitnessIndex = None
+
+        # Adaptive mode : operators and rates are tuned from the outcome of each child
+        self.adapt = AdaptiveController(self) if _adaptive else None
+
+        # Live telemetry, updated once per generation
+        self.metrics = _metrics
+        if self.metrics is not None:
+            self.metrics.attach(self)
 
         # performance data
         self.stat_inittime = 0
         self.stat_board = []
 
         # Reads data file
-        self.readUrlList()
+        if _data is not None:
+            self.data = dict(list(_data.items())[:self.strandSize])
+        elif self.store is None:
+            self.readUrlList()
+        else:
+            self.readUrlStore()
 
         # output management
         self.iprint("[c] Num of iterations set to : {}".format(self.maxIter))
         self.iprint("[c] Population size set to : {}".format(self.popSize))
         self.iprint("[c] Mutation rate set to : {}".format(self.mutationRate))
         self.iprint("[c] Initialization type defined to : {}".format(self.initType))
+        self.iprint("[c] Fitness metric defined to : {}".format(self.metric))
         self.iprint("[c] Selection operator defined to : {}".format(self.slctType))
         self.iprint("[c] Crossover operator defined to : {}".format(self.xovrType))
         if self.xpct is not None:
@@ -160,6 +213,24 @@ class BeeVolve:
             (id, url) = line.split()
             self.data[int(id)] = url
 
+    def readUrlStore(self):
+        """
+        Reading the list of URLs of the query from the store, importing the whole input file
+        (streamed, whatever its size) the first time the query is seen.
+        Population and mating pool are then loaded lazily.
+        """
+        self.queryId = self.store.getQueryId(self.query)
+        self.firstGeneration = self.store.nextGeneration(self.queryId)
+        self.data = self.store.loadUrls(self.queryId, _limit=self.strandSize)
+        if len(self.data) < self.strandSize:
+            count = self.store.importUrlFile(self.queryId, self.inputFile)
+            self.iprint("[c] {} urls imported from {}".format(count, self.inputFile))
+            self.data = self.store.loadUrls(self.queryId, _limit=self.strandSize)
+
+        self.population = LazyPopulation(self.store, self.queryId, POPULATION, self.data,
+                                         self.strandSize, self.cacheSize)
+        self.matingPool = LazyPopulation(self.store, self.queryId, MATINGPOOL, self.data,
+                                         self.strandSize, self.cacheSize)
 
     def initPopulation(self):
         """
@@ -167,11 +238,12 @@ class BeeVolve:
         """
 
         # 1. initialize the population up to popSize
-        for j in range(0, self.popSize):
+        # (a stored population is resumed, only the missing strands are created)
+        for genes in self.seedGenes(self.popSize - len(self.population)):
 
             strand = Strand(_strandSize=self.strandSize,
                             _origGenes=self.data,
-                            _childGenes=None, _nni=False)
+                            _childGenes=genes, _nni=self.initType == "ROT", _fitnessFn=self.fitnessFn)
             strand.computeStrandFitness()
             self.population.append(strand)
 
@@ -181,32 +253,97 @@ class BeeVolve:
 
         # Determine the best initial strand. In test mode, this uses index distance
         # and inversion counts only as no user is involved in the process.
-        self.best = self.population[0].copy()
-        for s in self.population:
-            if self.best.getStrandFitness() > s.getStrandFitness():
-                self.best = s.copy()
+        if self.store is not None:
+            self.best = self.population.bestStrand()
+        else:
+            self.best = self.population[0].copy()
+            for s in self.population:
+                if self.best.getStrandFitness() > s.getStrandFitness():
+                    self.best = s.copy()
 
         self.iprint("Best initial sorting: {}".format(self.best.getStrandFitness()))
 
+        if self.steadyState is not None:
+            # Parents are picked directly from the population, there is no generation to pool
+            self.matingPool = self.population
+            self.fitnessIndex = FitnessIndex(self.popSize)
+            for slot, strand in enumerate(self.population):
+                self.fitnessIndex.update(slot, strand.getStrandFitness())
+
+    def seedGenes(self, count):
+        """
+        returns the genes of count new strands according to the initialization type (see BeeInit),
+        None leaving it to Strand to shuffle (RGS) or rotate (ROT) the original ranking
+        """
+        seeds = []
+        if self.initType == "WRM":
+            warmStart = WarmStart(self.warmDir if self.warmDir is not None else WARM_DIR)
+            seeds = warmStart.load(self.query, self.metric, self.data.keys())[:count]
+            self.iprint("[c] {} strands warm started from previous runs".format(len(seeds)))
+        if self.initType in ("NNI", "WRM"):
+            genes = list(self.data.keys())
+            seeds.extend(nearestNeighbourInsertion(genes) for _ in range(count - len(seeds)))
+        return seeds + [None] * (count - len(seeds))
+
+    def saveWarmStart(self):
+        """
+        Keep the best strands of this run for the next runs of the query (WRM initialization)
+        """
+        if self.warmDir is None or self.best is None:
+            return
+        warmStart = WarmStart(self.warmDir)
+        if self.store is not None:
+            fittest = self.store.bestStrands(self.queryId, POPULATION, self.data, self.strandSize, warmStart.keep)
+        else:
+            fittest = sorted(self.population, key=lambda s: s.getStrandFitness())[:warmStart.keep]
+        warmStart.save(self.query, self.metric, [self.best] + fittest)
+
     def updateBest(self, candidate):
+        if self.provisional:
+            return
         if self.best is None or candidate.getStrandFitness() < self.best.getStrandFitness():
             self.best = candidate.copy()
             self.iprint("iteration: {} - best: {}".format(self.iteration,
                                                           self.best.getStrandFitness()))
 
-    def stigmerSelection(self, sA, sB):
+    def stigmerSelection(self, _count=2):
+        """
+        In the selection mode, the user picks up a predefined set of n strands
+        to be mixed up and evaluated together.
+        Unlike the automated selections, the slots of the strands are returned : the user decision
+        comes back later and the child has to replace one of the parents in the population
+        """
         # TODO:
-        #   In the selection mode, the user picks up a predefined set of n strands
-        #   to be mixed up and evaluated together
-        #   evaluating mode than 2 strands together might reduce the curating process time
-        pass
+        #   evaluating more than 2 strands together might reduce the curating process time
+        return random.sample(range(self.popSize), _count)
 
-    def RelationalSelection(self, sA, sB):
-        # TODO:
-        #   For this mode, a stigmer get strands assigned based on relational information
-        #   This can only be a valuable mode when the stigmer network have accumulated enough
-        #   relational information
-        pass
+    def RelationalSelection(self, _user=None):
+        """
+        For this mode, a stigmer get strands assigned based on relational information :
+        each parent is a strand a random friend of the stigmer preferred on the same topic (query).
+        This can only be a valuable mode when the stigmer network have accumulated enough
+        relational information, so we fall back to a binary tournament when friends have no preference.
+        In the automated loop, no stigmer is involved and a random one is drawn.
+        """
+        index = self.relational
+        user = _user if _user is not None else random.randrange(index.graph.numUsers)
+        genesA = index.pick(self.query, user)
+        genesB = index.pick(self.query, user)
+        if genesA is None or genesB is None:
+            return self.binaryTournamentSelection()
+        return [self.preferredStrand(genesA), self.preferredStrand(genesB)]
+
+    def preferredStrand(self, genes):
+        """
+        The strand of genes preferred by a stigmer, it may have left the population since.
+        It is scored once (again only if the fitness function changed), parents are never modified
+        """
+        strand = self.preferred.get(genes)
+        if strand is None or strand.fitnessFn != self.fitnessFn:
+            if len(genes) != len(self.data) or set(genes) != self.data.keys():
+                raise ValueError("preferred strand is not a ranking of the urls of {} : {}".format(self.query, genes))
+            strand = self.preferred[genes] = Strand(self.strandSize, self.data, list(genes), _fitnessFn=self.fitnessFn)
+        return strand
 
     def randomSelection(self):
         """
@@ -232,18 +369,47 @@ class BeeVolve:
                 winingStrands.append(sB)
         return winingStrands
 
-    def stigmerCrossover(self, sA, sB):
+    def stigmerCrossover(self, sA, sB, accepted, rejected):
+        """
+        For this mode, we don't care about actual sorting performance over the original index
+        We only care about which one is rejected by the user based on the proposed url sets.
+        Urls are mixed up and proposed all at once (see BeeStigmer), so that user is not influenced when selecting.
+
+        The child keeps the consensus order of both parents (mean position of each url),
+        except that the urls accepted by the user move ahead of the others and the rejected ones
+        fall behind.
+        """
         # TODO:
-        #   For this mode, we don't care about actual sorting performance over the original index
-        #   We only care about which one is rejected by the user based on the proposed url sets.
-        #   Urls should be mixed up and proposed all at once, so that user is not influenced when selecting
         #   Useful work of curating the network can be rewarded
         #   It could also be interesting to check if the performance is close to the original
         #   sort (indicative of whether the data source is good at proposing good sets or urls)
-        #   To be discussed with the dev because the way to implement this method impacts the interface
-        pass
+        posA = {gene: i for i, gene in enumerate(sA.strandGenes)}
+        posB = {gene: i for i, gene in enumerate(sB.strandGenes)}
+        accepted = set(accepted)
+        rejected = set(rejected)
+
+        def rank(gene):
+            group = 0 if gene in accepted else 2 if gene in rejected else 1
+            return (group, posA[gene] + posB.get(gene, posA[gene]))
+
+        childGenes = sorted(sA.strandGenes, key=rank)
+        child = Strand(self.strandSize, sA.origGenes, childGenes, _fitnessFn=self.fitnessFn)
+        self.updateBest(child)
+        return child
 
     def similarityBasedCrossover(self, sA, sB):
+        """
+        The fitter of the two children of similarityBasedChildren()
+        """
+        child1, child2 = self.similarityBasedChildren(sA, sB)
+        if child1.getStrandFitness() < child2.getStrandFitness():
+            self.updateBest(child1)
+            return child1
+        else:
+            self.updateBest(child2)
+            return child2
+
+    def similarityBasedChildren(self, sA, sB, _score=True):
         """
         For this specific algorithm, strands can be initialized from different urls and therefore
         a uniform crossover is not possible over the whole strand. So instead we are going to
@@ -255,6 +421,8 @@ class BeeVolve:
         2. I perform a full uniform crossover on the sub index and create the childs accordingly
 
         When applied to a population where all individuals share the same genes, it is basically a uniform crossover.
+
+        Both children are returned, unscored (fitness 0) unless _score is set
         """
 
         commonset = set(sA.strandGenes) & set(sB.strandGenes)
@@ -295,8 +463,9 @@ class BeeVolve:
                 pos += 1
 
         # Now that we got the subchild genes list, we reassemble them in either childA or childB
-        childGenes1 = sA.strandGenes
-        childGenes2 = sB.strandGenes
+        # (on copies : parents stay untouched in the mating pool, which may be cached from the store)
+        childGenes1 = list(sA.strandGenes)
+        childGenes2 = list(sB.strandGenes)
         for i in range(0, len(commonset)):
             childGenes1[sA.strandGenes.index(sAsub[i])] = subchildGenes[i]
             childGenes2[sB.strandGenes.index(sBsub[i])] = subchildGenes[i]
@@ -310,26 +479,19 @@ class BeeVolve:
         for i in range(0, len(childGenes2) ):
             childdata2[childGenes2[i]] = self.data[i]
 
-        # Now we got a final child to propagate
-        child1 = Strand(self.strandSize, childdata1, childGenes1)
-        child2 = Strand(self.strandSize, childdata2, childGenes2)
-
-        child1.computeStrandFitness()
-        child2.computeStrandFitness()
+        # Now we got the children to propagate (Strand computes their fitness)
+        fitness = None if _score else 0
+        child1 = Strand(self.strandSize, childdata1, childGenes1, _fitnessFn=self.fitnessFn, _fitness=fitness)
+        child2 = Strand(self.strandSize, childdata2, childGenes2, _fitnessFn=self.fitnessFn, _fitness=fitness)
+        return child1, child2
 
-        if child1.getStrandFitness() < child2.getStrandFitness():
-            self.updateBest(child1)
-            return child1
-        else:
-            self.updateBest(child2)
-            return child2
-
-    def scrambleMutation(self, strand):
+    def scrambleMutation(self, strand, _score=True):
         """
         This will select a subset of strandGenes and randomly shuffle them
+        (the strand is left to be scored by the caller unless _score is set)
         """
         if random.random() > self.mutationRate:
-            return
+            return False
 
         # Define a mutation section size
         if self.apct is not None:
@@ -345,13 +507,51 @@ class BeeVolve:
         random.shuffle(subset)
         strand.strandGenes[sectionstart:sectionstart + sectionsize] = subset
 
-        strand.computeStrandFitness()
-        self.updateBest(strand)
+        if _score:
+            strand.computeStrandFitness()
+            self.updateBest(strand)
+        return True
+
+    def inversionMutation(self, strand, _score=True):
+        """
+        This will select a subset of strandGenes and reverse its order
+        (the strand is left to be scored by the caller unless _score is set)
+        """
+        if random.random() > self.mutationRate:
+            return False
+
+        if self.apct is not None:
+            sectionsize = max(2, int(self.strandSize * self.apct / 100))
+        else:
+            sectionsize = random.randint(2, self.strandSize)
+        sectionstart = random.randint(0, self.strandSize - sectionsize)
+
+        strand.strandGenes[sectionstart:sectionstart + sectionsize] = \
+            strand.strandGenes[sectionstart:sectionstart + sectionsize][::-1]
+
+        if _score:
+            strand.computeStrandFitness()
+            self.updateBest(strand)
+        return True
+
+    def mutate(self, strand, _score=True):
+        """
+        Apply the mutation operator (picked by the adaptive controller in adaptive mode),
+        returns True when the strand was mutated
+        """
+        mutnType = self.mutnType if self.adapt is None else self.adapt.chooseMutation()
+        if mutnType == "INV":
+            return self.inversionMutation(strand, _score)
+        return self.scrambleMutation(strand, _score)
 
     def poolFitness(self):
         """
         get the best fitness of the mating pool.
         """
+        if self.fitnessIndex is not None:
+            return self.fitnessIndex.best()[1]
+        if self.store is not None:
+            return self.matingPool.bestFitness()
         bestStrandFitness = self.matingPool[0].getStrandFitness()
         for i in range(1, self.popSize):
             fit = self.matingPool[i].getStrandFitness()
@@ -364,12 +564,14 @@ class BeeVolve:
         """
         # In bestOnly mode, an item only gets replaced in the matting pool if the replacement is fitter
         # This allows the pool to converge much faster
-        if self.bestonly == False:
+        if self.bestonly == False and self.store is not None:
+            self.matingPool.assignFrom(self.population)
+        elif self.bestonly == False:
             self.matingPool = []
             for strand in self.population:
                 self.matingPool.append(strand.copy())
         else:
-            if len(self.matingPool) == 0: self.matingPool = []
+            if len(self.matingPool) == 0 and self.store is None: self.matingPool = []
             for i in range(0, self.popSize):  # self.population:
                 if len(self.matingPool) == self.popSize:
                     if self.population[i].getStrandFitness() < self.matingPool[i].getStrandFitness():
@@ -377,6 +579,18 @@ class BeeVolve:
                 else:
                     self.matingPool.append(self.population[i].copy())
 
+    def selectParents(self):
+        """
+        Two parents, depending on the slctType selected
+        (user pick up of instances ("USR") is driven by user votes, see BeeStigmer.StigmerService)
+        """
+        if self.slctType == "RDM":
+            return self.randomSelection()
+        elif self.slctType == "FRD":
+            return self.RelationalSelection()
+        else:  # "BIN":
+            return self.binaryTournamentSelection()
+
     def newGeneration(self):
         """
         Creating a new generation
@@ -390,27 +604,25 @@ class BeeVolve:
 
             # Depending on the slctType selected :
             s1 = timeit.default_timer()
-            if self.slctType == "RDM":
-                parent1, parent2 = self.randomSelection()
-            else:  # "BIN":
-                parent1, parent2 = self.binaryTournamentSelection()
-            # TODO:
-            #    add self.StigmerSelection() : User pick up of instances ("USR")
-            #    add self.RelationalSelection() : Depending of friends preference on same topic ("FRD")
+            parent1, parent2 = self.selectParents()
 
             # Depending on the xovrType selected :
             s2 = timeit.default_timer()
+            # (the user-based self.stigmerCrossover() ("STG") needs votes, see BeeStigmer.StigmerService)
+            if self.adapt is not None:
+                self.adapt.chooseCrossover()
             child = self.similarityBasedCrossover(parent1, parent2)
-            # TODO:
-            #    add self.stigmerCrossover() crossover implementation (user-based)
 
             # Depending on the mutnType selected :
             s3 = timeit.default_timer()
-            self.scrambleMutation(child)
-            # TODO:
-            #    add self.inversionMutation() type
+            before = child.getStrandFitness()
+            mutated = self.mutate(child)
 
             s4 = timeit.default_timer()
+            if self.adapt is not None:
+                self.adapt.recordCrossover(parent1, parent2, before)
+                if mutated:
+                    self.adapt.recordMutation(before, child)
 
             # Updating the population with the child
             # We replace the strand that lost the round
@@ -420,20 +632,120 @@ class BeeVolve:
             stat_i = [s2 - s1, s3 - s2, s4 - s3, 0]
             stat_gen = list(map(operator.add, stat_gen, stat_i))
 
+        if self.adapt is not None:
+            self.adapt.endGeneration()
+
         # append best fitness so far to the statistics
         stat_gen[3] = self.best.getStrandFitness()
         stat_gen.append(self.poolFitness())
         stat_gen.append(self.best.strandGenes)
         self.stat_board.append(stat_gen)
 
+    def newGenerationBatch(self):
+        """
+        newGeneration for a batch fitness function (BeeFitness.FitnessMetric) : the children of the
+        generation are scored in two calls instead of one by one, the crossover children of every
+        pair of parents first, then the mutated ones
+        """
+        size = len(self.population)
+        s1 = timeit.default_timer()
+        parents = [self.selectParents() for _ in range(size)]
+
+        s2 = timeit.default_timer()
+        pairs = [self.similarityBasedChildren(parent1, parent2, _score=False) for parent1, parent2 in parents]
+        evaluateStrands([child for pair in pairs for child in pair], self.fitnessFn)
+        children = [child1 if child1.getStrandFitness() < child2.getStrandFitness() else child2
+                    for child1, child2 in pairs]
+        for child in children:
+            self.updateBest(child)
+
+        s3 = timeit.default_timer()
+        mutated = [child for child in children if self.mutate(child, _score=False)]
+        evaluateStrands(mutated, self.fitnessFn)
+        for child in mutated:
+            self.updateBest(child)
+
+        s4 = timeit.default_timer()
+        for i in range(size):
+            self.population[i] = children[i]
+
+        self.stat_board.append([s2 - s1, s3 - s2, s4 - s3, self.best.getStrandFitness(), self.poolFitness(),
+                                self.best.strandGenes])
+
+    def steadyStateStep(self):
+        """
+        Steady-state replacement : breed self.steadyState children, each one replacing the worst
+        strand of the population if it is fitter. Best, worst and pool fitness come from the
+        FitnessIndex in O(log n), instead of a scan of the population
+        """
+        stat_step = [0, 0, 0, 0]
+
+        for _ in range(self.steadyState):
+            s1 = timeit.default_timer()
+            parent1, parent2 = self.selectParents()
+
+            s2 = timeit.default_timer()
+            if self.adapt is not None:
+                self.adapt.chooseCrossover()
+            child = self.similarityBasedCrossover(parent1, parent2)
+
+            s3 = timeit.default_timer()
+            before = child.getStrandFitness()
+            mutated = self.mutate(child)
+
+            s4 = timeit.default_timer()
+            if self.adapt is not None:
+                self.adapt.recordCrossover(parent1, parent2, before)
+                if mutated:
+                    self.adapt.recordMutation(before, child)
+            slot, worst = self.fitnessIndex.worst()
+            if child.getStrandFitness() < worst:
+                self.population[slot] = child
+                self.fitnessIndex.update(slot, child.getStrandFitness())
+
+            stat_i = [s2 - s1, s3 - s2, s4 - s3, 0]
+            stat_step = list(map(operator.add, stat_step, stat_i))
+
+        if self.adapt is not None:
+            self.adapt.endGeneration()
+
+        stat_step[3] = self.best.getStrandFitness()
+        stat_step.append(self.poolFitness())
+        stat_step.append(self.best.strandGenes)
+        self.stat_board.append(stat_step)
+
     def GeneticStigmergicStep(self):
         """
         One step in the Genetic Stigmergic main algorithm
         1. Updating the mating pool with current population
         2. Creating a new Generation using selection / crossover / mutation
+        (in steady-state mode, a few children replace the worst strands instead)
+        """
+        if self.steadyState is not None:
+            self.steadyStateStep()
+        else:
+            self.updateMatingPool()
+            # Adaptive mode credits the operators child by child
+            if isinstance(self.fitnessFn, FitnessMetric) and self.adapt is None:
+                self.newGenerationBatch()
+            else:
+                self.newGeneration()
+        if self.store is not None:
+            self.population.flush()
+            self.store.saveBest(self.queryId, self.firstGeneration + self.iteration, self.best)
+
+    def step(self):
+        """
+        Advance by one generation, returns False once maxIter generations are done
         """
-        self.updateMatingPool()
-        self.newGeneration()
+        if self.iteration >= self.maxIter:
+            return False
+        begin = timeit.default_timer()
+        self.GeneticStigmergicStep()
+        self.iteration += 1
+        if self.metrics is not None:
+            self.metrics.generation(self, timeit.default_timer() - begin)
+        return True
 
     def run(self):
         """
@@ -442,8 +754,8 @@ class BeeVolve:
         """
         self.iteration = 0
         while self.iteration < self.maxIter:
-            self.GeneticStigmergicStep()
-            self.iteration += 1
+            self.step()
+        self.saveWarmStart()
 
         self.iprint("Total iterations: {}".format(self.iteration))
         self.iprint("Best Solution: {}".format(self.best.getStrandFitness()))
@@ -1,7 +1,14 @@
 # Test example for beesearch & BeeVolve
 
+import asyncio
 from BeeSearch import GoogleSearch
 from BeeVolve import *
+from BeeStigmer import StigmerService, simulateUsers
+from BeeSurrogate import SurrogateVolve
+from BeePreference import PreferenceModel
+from BeeGraph import SocialGraph, RelationalIndex
+from BeeDB import BeeDB, SQLiteStandIn
+from BeeMetrics import VolveMetrics, MetricsServer
 
 # Strand instanciation test
 
@@ -10,10 +17,14 @@ def usage():
     Usage : 
 
     > python {} [-f|--file <file.tsp>] [-n|--niter <number>] [-p|--pmod <size>] [-r|--rate <number>] 
-                {{-e|--execs <number>}} {{-i|--inittype [RGT|NNI]}} {{-s|--selection [RDM|BIN]]}} 
+                {{-e|--execs <number>}} {{-i|--inittype [RGS|NNI|ROT|WRM]}} {{-s|--selection [RDM|BIN]]}} 
                 {{-c|--crossover [UNI|ORD|USR|]}} {{-m|--mutation [SCR|INV]}} 
                 {{-a|--alterpct [0-100]}} {{-x|--xovrpct [0-100]}} 
                 {{-v|--verbose}} {{-w|--writestats}} {{-b|--bestonly}}
+                {{--store <database>}} {{--query <text>}} {{-u|--users <number>}}
+                {{--model <file>}} {{-g|--graph <file>}} {{--prefs <file>}}
+                {{-t|--steadystate <number>}} {{-k|--metric [INV|KEN|SPR|DCG]}} {{-d|--adaptive}}
+                {{--metrics <port>}} {{--surrogate <fraction>}} {{--warmstart}}
 
     Arguments 
 
@@ -28,8 +39,11 @@ def usage():
 
     Optional :
 
-    -i|--inittype           [RGS|NNI] : Initialization mode, either RGS (Randomly Generated Strands) or 
-                                        NNI (Nearest neighbor insertion) - default : RGT
+    -i|--inittype           [RGS|NNI|ROT|WRM] : Initialization mode, either RGS (Randomly Generated Strands),
+                                        NNI (Nearest neighbor insertion), ROT (Rotations of the original ranking)
+                                        or WRM (Warm start from the best strands of the previous runs of the
+                                        query with the same metric, saved under output/warmstart, see
+                                        --warmstart) - default : RGS
 
     -s|--selection          [RDM|BIN|USR|FRD] : Type or selection performed from the matting pool, RDM (Random),
                                         BIN (BinaryTournament), USR (User-based), FRD (relation-based) - default : RDM
@@ -40,12 +54,13 @@ def usage():
                                         STG is production mode (fitness evaluated based on user decisions)
                                         Other mixed modes might be possible in the future.
 
-                                        Note : ORD, STG not implemented yet ! 
+                                        USR selection and STG crossover both run the user curation service
+                                        (BeeStigmer) against simulated users, see -u
+
+                                        Note : ORD not implemented yet ! 
 
     -m|--mutation           [SCR|INV] : Mutation operator choice, either SCR (Scrambling) or INV (Inversion)
                                         - default : SCR 
-                                        
-                                        Note : INV not implemented yet !
 
     -a|--alterpct           <integer> : determines in what proportion (percentage of genes)
                                         an individual will be mutated whenever a mutation occurs
@@ -60,9 +75,60 @@ def usage():
 
     -b|--bestonly           Update an individual in the mating pool only if its replacement has better fitness
 
+    -d|--adaptive           Tune the mutation rate, the mutation and crossover section sizes and the mutation
+                            operator online, from the success of the children of each generation
+
+    --metrics               <port>     : serve live run metrics (generations, phase latencies, fitness,
+                                        cache hit ratios, memory) in the Prometheus text format on
+                                        http://127.0.0.1:<port>/metrics
+
+    --warmstart             Save the best strands of the run under output/warmstart (per query and metric),
+                            for the WRM initialization of the next runs. Implied by -i WRM
+
+    --surrogate             <fraction> : surrogate-assisted mode (test modes only), twice the population size
+                                        of children is bred per generation, pre-scored by a cheap model, and
+                                        only <fraction> x psize of them (eg. 0.25) are evaluated for real
+
+    --store                 <database> : persist urls, population and best strand history in a database,
+                                        either user:password@host:port/database (MariaDB) or a SQLite file.
+                                        A stored population for the same query is resumed.
+
+    --query                 <text>     : the query the population is stored under (default : the input file)
+
+    -u|--users              <integer>  : number of concurrent simulated users in user curation mode (USR/STG)
+                                        - default : 100. niter * psize votes are cast in total
+
+    --model                 <file>     : user preference model snapshot, loaded if it exists and saved at the end
+                                        of a user curation run (USR/STG)
+
+    -g|--graph              <file>     : friend graph for the FRD selection, one "<user id> <friend id>" per line
+
+    --prefs                 <file>     : strands preferred by users on the query for the FRD selection,
+                                        one "<user id> <url id> <url id> ..." per line (the preferred ranking)
+
+    -t|--steadystate        <integer>  : steady-state mode, each iteration breeds <integer> children replacing
+                                        the worst strands instead of a whole new generation
+
+    -k|--metric             [INV|KEN|SPR|DCG] : test fitness metric against the original ranking, INV (weighted
+                                        inversions), KEN (Kendall tau distance), SPR (Spearman footrule) or
+                                        DCG (1 - NDCG) - default : INV
+
     """.format(sys.argv[0]))
 
 
+def openStore(spec):
+    """
+    Open a BeeStore from a --store argument : user:password@host:port/database or a SQLite file
+    """
+    if "@" in spec:
+        credentials, location = spec.rsplit("@", 1)
+        user, password = credentials.split(":", 1)
+        hostport, database = location.split("/", 1)
+        host, port = hostport.split(":") if ":" in hostport else (hostport, 3306)
+        return BeeStore(BeeDB(user, password, host, int(port), database))
+    return BeeStore(BeeDB(None, None, None, None, spec, _connector=SQLiteStandIn(spec)))
+
+
 def main(argv):
     if not os.path.exists("output"):
         os.mkdir("output")
@@ -87,15 +153,27 @@ def main(argv):
     rate = None
     apct = None
     xpct = None
+    store = None
+    query = None
+    users = 100
+    modelfile = None
+    graphfile = None
+    prefsfile = None
+    steadystate = None
+    metric = "INV"
+    adaptive = False
+    metricsport = None
+    surrogate = None
+    warmstart = False
 
     try:
         if len(argv) < 2:
             usage()
             sys.exit(2)
-        opts, args = getopt.getopt(argv, "f:i:s:c:m:r:p:n:a:x:o:z:vb",
+        opts, args = getopt.getopt(argv, "f:i:s:c:m:r:p:n:a:x:o:z:u:g:t:k:vbd",
                                    ["file=", "inittype=", "selection=", "crossover=", "mutation=",
                                     "rate=", "psize=", "niter=", "alterpct=", "xovrpct=", "outfile=",
-                                    "strandsize=", "verbose", "bestonly"])
+                                    "strandsize=", "verbose", "bestonly", "store=", "query=", "users=", "model=", "graph=", "prefs=", "steadystate=", "metric=", "adaptive", "metrics=", "surrogate=", "warmstart"])
     except getopt.GetoptError:
         usage()
         sys.exit(2)
@@ -133,26 +211,65 @@ def main(argv):
             elif opt in ("-b", "--bestonly"):
                 bestonly = arg
 
+            elif opt in ("-d", "--adaptive"):
+                adaptive = True
+
+            elif opt == "--metrics":
+                metricsport = int(arg)
+
+            elif opt == "--surrogate":
+                surrogate = float(arg)
+
+            elif opt == "--warmstart":
+                warmstart = True
+
             elif opt in ("-f", "--file"):
                 infile = arg
 
+            elif opt == "--store":
+                store = openStore(arg)
+
+            elif opt == "--query":
+                query = arg
+
+            elif opt in ("-u", "--users"):
+                users = int(arg)
+
+            elif opt == "--model":
+                modelfile = arg
+
+            elif opt in ("-g", "--graph"):
+                graphfile = arg
+
+            elif opt == "--prefs":
+                prefsfile = arg
+
+            elif opt in ("-t", "--steadystate"):
+                steadystate = int(arg)
+
+            elif opt in ("-k", "--metric"):
+                if arg in METRICS:
+                    metric = arg
+                else:
+                    print("[!] Unrecognized fitness metric, defaulting to INV - Weighted inversions")
+
             elif opt in ("-i", "--inittype"):
-                if arg in ("NNI", "RGS"):
+                if arg in ("NNI", "RGS", "ROT", "WRM"):
                     strandtype = arg
                 else:
                     print("[!] Unrecognized initialization type, defaulting to RGS - Randomly Generated Strands")
             elif opt in ("-s", "--selection"):
-                if arg in ("RDM", "BIN"):  # TODO : add "STG", "REL"
+                if arg in ("RDM", "BIN", "USR", "FRD"):
                     slcttype = arg
                 else:
                     print("[!] Unrecognized selection operator, defaulting to BIN - Binary Tournament")
             elif opt in ("-c", "--crossover"):
-                if arg in ("SIM"): # TODO : add "STG"
+                if arg in ("SIM", "STG"):
                     xovrtype = arg
                 else:
                     print("[!] Unrecognized crossover operator, defaulting to SIM - Similarity-Based Crossover")
             elif opt in ("-m", "--mutation"):
-                if arg in ("SCR"): # TODO : add "INV"
+                if arg in ("SCR", "INV"):
                     mutntype = arg
                 else:
                     print("[!] Unrecognized mutation operator, defaulting to SCR - Scrambling")
@@ -177,6 +294,23 @@ def main(argv):
         usage()
         sys.exit()
 
+    relational = None
+    if slcttype == "FRD":
+        if graphfile is None or prefsfile is None:
+            print("[E] FRD selection needs a friend graph and preferences. missing -g <file> --prefs <file>")
+            usage()
+            sys.exit()
+        relational = RelationalIndex(SocialGraph.fromFile(graphfile))
+
+    metrics = None
+    if metricsport is not None:
+        metrics = VolveMetrics()
+        MetricsServer(metrics.registry, metricsport).start()
+
+    if slcttype == "USR" or xovrtype == "STG":
+        # User fitness is not comparable with the test metrics (warm start)
+        metric = "USR"
+
     run_stat = []
     beeVolve = BeeVolve(_inputFile=infile,
                         _psize=psize,
@@ -191,9 +325,44 @@ def main(argv):
                         _xpct=xpct,
                         _verbose=verbose,
                         _bestOnly=bestonly,
-                        _outfile=outfile, _chkptFile=None)
-
-    beeVolve.run()
+                        _outfile=outfile, _chkptFile=None,
+                        _store=store, _query=query, _relational=relational,
+                        _steadyState=steadystate,
+                        _warmDir=WARM_DIR if warmstart or strandtype == "WRM" else None,
+                        _metric=metric, _adaptive=adaptive, _metrics=metrics)
+
+    if relational is not None:
+        # Preferences are checked against the urls of the query
+        relational.loadPreferences(beeVolve.query, prefsfile, _urls=beeVolve.data.keys())
+
+    if slcttype == "USR" or xovrtype == "STG":
+        # User curation : fitness comes from (simulated) user votes
+        if surrogate is not None:
+            print("[!] The surrogate-assisted mode is not available in user curation yet, ignored")
+        model = None
+        if modelfile is not None and os.path.exists(modelfile):
+            model = PreferenceModel.load(modelfile, strandsize)
+        service = StigmerService(beeVolve, _model=model)
+        stats = asyncio.run(simulateUsers(service, _users=users, _votes=niter * psize))
+        if modelfile is not None:
+            service.model.save(modelfile)
+        beeVolve.saveWarmStart()
+        for key, value in stats.items():
+            beeVolve.iprint("[s] {} : {}".format(key, value))
+    elif surrogate is not None:
+        # Only the children routed by the surrogate get a real evaluation
+        assisted = SurrogateVolve(beeVolve, _evalFraction=surrogate)
+        while beeVolve.iteration < niter:
+            assisted.step()
+        beeVolve.saveWarmStart()
+        beeVolve.iprint("[s] real evaluations : {}".format(assisted.evaluations))
+        beeVolve.iprint("Best Solution: {}".format(beeVolve.best.getStrandFitness()))
+        if verbose == True: beeVolve.display_stats()
+    else:
+        beeVolve.run()
+        if beeVolve.adapt is not None:
+            for key, value in beeVolve.adapt.stats().items():
+                beeVolve.iprint("[s] adaptive {} : {}".format(key, value))
 
     t_slct = 0
     t_xovr = 0